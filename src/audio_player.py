@@ -1,120 +1,376 @@
 from subprocess import Popen, PIPE, DEVNULL
 from threading import Thread, Event
-from time import sleep
+from time import perf_counter, sleep
 
-from pyaudio import PyAudio
+from pyaudio import PyAudio, paContinue
+
+from mixer import HitSoundMixer
+from ring_buffer import RingBuffer
 
 
 class AudioPlayer:
-    def __init__(self, delay_time):
+
+    START_LATENCY_TARGET = .05  # seconds the first audible sample may trail the planned start of a song
+
+    def __init__(self, delay_time, frame_size=256, buffer_frames=8192, pcm_cache=None):
         self.pyaudio = PyAudio()
 
-        self.frame_size = 512
+        self.frame_size = frame_size
         self.sample_rate = 44100
         self.frame_time = self.frame_size / self.sample_rate
         self.sample_width = 2  # bytes
         self.channels = 2
-        self.chunk_size = self.frame_size * self.sample_width * self.channels
+        self.bytes_per_frame = self.sample_width * self.channels
+        self.chunk_size = self.frame_size * self.bytes_per_frame
+        self.speed = 1  # playback speed, audio at other speeds is time stretched by ffmpeg and cached separately
+        self.pcm_format = self.get_pcm_format(self.speed)
 
+        # the output stream stays open and plays silence between songs, so starting a song doesn't wait on the device
         self.device = None
+        self.device_index = None
+        self.devices = None  # cached output devices
+        self.filepath = None
         self.ffmpeg_process = None
         self.data_stream = None
 
+        # decoded tracks are played from the cache, otherwise ffmpeg output is copied into it while playing
+        self.pcm_cache = pcm_cache
+        self.pcm_data = None
+        self.read_position = 0
+        self.cache_writer = None
+
+        # a track queued to follow the current one gaplessly, the decoder switches to it when the current one runs out
+        # and the callback starts its clock once playback reaches the point it was switched at
+        self.next_audio = None  # filepath
+        self.previous_source = None  # (filepath, pcm data) of the track still playing after a switch
+        self.track_boundary = None  # buffer write count the queued track starts at, until the callback reaches it
+        self.track_number = 0  # increases whenever a queued track starts playing
+
+        # decoded audio waiting for the output callback, buffer_frames sets how long a decoder stall can be hidden
+        self.buffer = RingBuffer(buffer_frames * self.bytes_per_frame)
+        self.output = bytearray(self.chunk_size)
+        self.output_view = memoryview(self.output)
+        self.silence = bytes(self.chunk_size)
+        self.playing = False  # callback consumes the buffer
+        self.decoding = False  # source has more data
+        self.underruns = 0
+
+        # hit sounds are mixed into the music in the callback
+        self.hit_sounds = HitSoundMixer(self.sample_rate, self.channels)
+
         self.stream_open = Event()
         self.unpaused = Event()
         self.unpaused.set()
         self.idle = Event()
         self.idle.set()
 
-        self.time = 0
+        # playback position, from frames consumed by the callback and when they reach the speakers
+        self.start_frame = 0
+        self.frames_played = 0
+        self.started = False  # callback has played a buffer of the track
+        self.clock_reference = None  # (track time of the last callback's buffer, stream time it plays at)
+        self.output_latency = 0
+        self.play_time = 0  # perf_counter time playback starts
+        self.paused_time = 0
         self.delay_time = delay_time
+        self.start_latency = None  # seconds from the planned start of the last song to its first audible sample
+        self.first_sample_time = None
 
-        self.fast_forward_time = 0
+        # seeks are numbered, the decoder thread handles them in order and the callback applies the latest
+        self.seek_request = (0, 0)  # (seek number, time)
+        self.seek_handled = 0  # by the decoder thread
+        self.flush = (0, 0, 0)  # (seek number, buffer write count the seek starts at, frame it starts at)
+        self.seek_done = 0  # by the callback
 
-    def get_devices(self):
-        return [self.pyaudio.get_device_info_by_index(i)
-                for i in range(self.pyaudio.get_device_count())
-                if self.pyaudio.get_device_info_by_index(i)['maxOutputChannels'] == self.channels]
+    def get_devices(self, refresh=False):
+        if self.devices is None or refresh:
+            device_infos = (self.pyaudio.get_device_info_by_index(i) for i in range(self.pyaudio.get_device_count()))
+            self.devices = [device_info for device_info in device_infos if device_info['maxOutputChannels'] == self.channels]
+        return self.devices
 
     def set_device(self, device_index=-1):
+        # the new stream is opened before the old one is closed, so a failed switch keeps the current device and a song
+        # playing carries on from the same position
         try:
             if device_index == -1:
                 device_index = self.pyaudio.get_default_output_device_info()['index']
-            self.device = self.pyaudio.open(format=self.pyaudio.get_format_from_width(self.sample_width),
-                                            channels=self.channels,
-                                            rate=self.sample_rate,
-                                            output=True,
-                                            output_device_index=device_index)
-            return 0
+            if self.device and device_index == self.device_index:
+                return 0
+            device = self.pyaudio.open(format=self.pyaudio.get_format_from_width(self.sample_width),
+                                       channels=self.channels,
+                                       rate=self.sample_rate,
+                                       output=True,
+                                       output_device_index=device_index,
+                                       frames_per_buffer=self.frame_size,
+                                       stream_callback=self.audio_callback,
+                                       start=False)
         except OSError:
             print('ERROR: Invalid audio device set.')
             return 1
 
-    def open_audio(self, filepath):
+        old_device = self.device
+        if old_device:
+            self.paused_time = self.get_time()
+            old_device.stop_stream()
+        self.clock_reference = None
+        self.device = device
+        self.device_index = device_index
+        self.output_latency = device.get_output_latency()
+        device.start_stream()
+        if old_device:
+            old_device.close()
+        return 0
+
+    def get_pcm_format(self, speed):
+        return f's16le {self.sample_rate} {self.channels}' + (f' atempo={speed:.2f}' if speed != 1 else '')
+
+    def get_ffmpeg_command(self, filepath, source_time, speed):
+        ffmpeg_command = ['ffmpeg', '-ss', f'{source_time:.6f}', '-i', filepath, '-loglevel', 'error',
+                          '-f', 's16le', '-ac', str(self.channels), '-ar', str(self.sample_rate), '-']
+        if speed != 1:
+            ffmpeg_command[-1:-1] = ['-filter:a', f'atempo={speed:.2f}']
+        return ffmpeg_command
+
+    def prefetch(self, filepath, speed=1):
+        # decodes a track into the cache in the background, so it can start without waiting on ffmpeg
+        if not self.pcm_cache:
+            return
+        pcm_format = self.get_pcm_format(speed)
+        if self.pcm_cache.contains(filepath, pcm_format):
+            return
+        cache_writer = self.pcm_cache.create(filepath, pcm_format)
+        if cache_writer:
+            ffmpeg_process = Popen(self.get_ffmpeg_command(filepath, 0, speed), stdout=PIPE, stderr=DEVNULL)
+            Thread(target=AudioPlayer.finish_cache, args=(ffmpeg_process, cache_writer), daemon=True).start()
+
+    def queue_audio(self, filepath):
+        # plays filepath right after the current track ends, at the same speed
+        self.next_audio = filepath
+
+    def switch_to_queued_audio(self):
+        # on the decoder thread once the current track is fully decoded
+        self.close_source()
+        self.previous_source = self.filepath, self.pcm_data
+        self.filepath = self.next_audio
+        self.next_audio = None
+        self.pcm_data = self.pcm_cache.open(self.filepath, self.pcm_format) if self.pcm_cache else None
+        self.open_source(0)
+        self.track_boundary = self.buffer.write_count
+
+    def open_audio(self, filepath, start_time=0, speed=1):
         if not self.device:
             print('Device not initialized')
             return
 
-        ffmpeg_command = ['ffmpeg', '-i', filepath, '-loglevel', 'error', '-f', 's16le', '-ac', str(self.channels),
-                          '-ar', str(self.sample_rate), '-']
-        # speed modifier: '-filter:a', 'atempo=0.5'
-
-        self.ffmpeg_process = Popen(ffmpeg_command, stdout=PIPE, stderr=DEVNULL)
-        self.data_stream = self.ffmpeg_process.stdout
-        
-        self.device.start_stream()
+        self.filepath = filepath
+        self.speed = speed
+        self.pcm_format = self.get_pcm_format(speed)
+        self.pcm_data = self.pcm_cache.open(filepath, self.pcm_format) if self.pcm_cache else None
+        self.start_frame = self.open_source(start_time)
 
-        if self.fast_forward_time == 0:
-            self.fast_forward_time = self.device.get_write_available() / self.frame_size * self.frame_time
+        # the callback keeps running, and outputs silence until playing is set
+        self.flush = (0, 0, self.start_frame)
+        self.seek_done = self.seek_handled = 0
+        self.seek_request = (0, start_time)
+        self.buffer.clear()
+        self.decoding = True
+        self.underruns = 0
+        self.frames_played = self.start_frame
+        self.started = False
+        self.first_sample_time = None
+        self.clock_reference = None
+        self.paused_time = start_time
+        self.hit_sounds.clear()
 
         self.stream_open.set()
 
+    def open_source(self, start_time):
+        # positions the decoded audio at start_time, returning the frame it starts at
+        start_frame = max(0, round(start_time * self.sample_rate))
+        if self.pcm_data is not None:
+            self.read_position = min(start_frame * self.bytes_per_frame, len(self.pcm_data))
+            return start_frame
+
+        # without a cached decode ffmpeg seeks, in time of the original audio, and only a decode from the start is cached
+        self.close_source()
+        self.ffmpeg_process = Popen(self.get_ffmpeg_command(self.filepath, start_frame / self.sample_rate * self.speed, self.speed), stdout=PIPE, stderr=DEVNULL)
+        self.data_stream = self.ffmpeg_process.stdout
+        if start_frame == 0 and self.pcm_cache:
+            self.cache_writer = self.pcm_cache.create(self.filepath, self.pcm_format)
+        return start_frame
+
     def get_time(self):
-        return self.time
+        # seconds of the track heard so far, negative during the pre-track delay
+        if not self.unpaused.is_set() or self.seek_done != self.seek_request[0]:
+            return self.paused_time
+        clock_reference = self.clock_reference
+        if clock_reference is None:
+            if self.started:
+                return self.paused_time
+            return self.start_frame / self.sample_rate + perf_counter() - self.play_time - self.output_latency
+        buffer_time, dac_time = clock_reference
+        return min(buffer_time + self.device.get_time() - dac_time, self.frames_played / self.sample_rate)
+
+    def seek(self, time):
+        # the clock holds at time until the callback plays audio from there
+        self.paused_time = time
+        self.seek_request = (self.seek_request[0] + 1, time)
+
+    def play_hit_sound(self, name, time):
+        # scheduled a fixed delay after time, one buffer past the output latency, so hit sounds don't jitter with the callback
+        self.hit_sounds.schedule(name, round((time + self.output_latency) * self.sample_rate) + self.frame_size)
 
     def pause(self):
+        self.paused_time = self.get_time()
         self.unpaused.clear()
 
     def unpause(self):
+        # the clock holds still until the callback reports where playback resumed
+        self.clock_reference = None
         self.unpaused.set()
 
-    def play_chunk(self):
-        if self.unpaused.is_set():
-            chunk = self.data_stream.read(self.chunk_size)
-            if chunk:
-                self.time += self.frame_time / 2
-                self.device.write(chunk)
-                self.time += self.frame_time / 2
-            else:
-                self.stream_open.clear()
+    def audio_callback(self, in_data, frame_count, time_info, status):
+        # runs on the PortAudio thread, only copies out of the ring buffer
+        num_bytes = frame_count * self.bytes_per_frame
+        if num_bytes > len(self.output):
+            self.output = bytearray(num_bytes)
+            self.output_view = memoryview(self.output)
+            self.silence = bytes(num_bytes)
+
+        # skip audio decoded before the latest seek
+        flush = self.flush
+        if flush[0] != self.seek_done:
+            self.buffer.read_count = max(self.buffer.read_count, flush[1])
+            self.frames_played = flush[2]
+            self.clock_reference = None
+            self.hit_sounds.clear()
+            self.seek_done = flush[0]
+
+        if not self.playing or not self.unpaused.is_set():
+            return self.silence[:num_bytes] if num_bytes < len(self.silence) else self.silence, paContinue
+
+        num_read = self.buffer.read_into(self.output_view, num_bytes)
+        # a queued track starting in this buffer, its frames count from the boundary, so the clock is negative until then
+        track_boundary = self.track_boundary
+        if track_boundary is not None and self.buffer.read_count >= track_boundary:
+            self.frames_played = (self.buffer.read_count - num_read - track_boundary) // self.bytes_per_frame
+            self.track_boundary = None
+            self.track_number += 1
+            self.hit_sounds.clear()
+        if num_read < num_bytes:
+            if self.decoding:
+                self.underruns += 1
+            self.output_view[num_read:num_bytes] = self.silence[num_read:num_bytes]
+        if self.hit_sounds.is_active():
+            self.hit_sounds.mix(self.output_view[:num_bytes], self.frames_played)
+        # padding played during an underrun isn't track time, the clock holds until audio arrives again
+        self.clock_reference = (self.frames_played / self.sample_rate, time_info['output_buffer_dac_time'])
+        self.frames_played += num_read // self.bytes_per_frame
+        if not self.started:
+            self.first_sample_time = perf_counter() + time_info['output_buffer_dac_time'] - time_info['current_time']
+            self.started = True
+        return bytes(self.output_view[:num_bytes]), paContinue
+
+    def read_chunk(self):
+        if self.pcm_data is not None:
+            chunk = self.pcm_data[self.read_position:self.read_position + self.chunk_size]
+            self.read_position += len(chunk)
+            return chunk
+
+        chunk = self.data_stream.read(self.chunk_size)
+        if chunk and self.cache_writer:
+            self.cache_writer.write(chunk)
+        return chunk
+
+    @staticmethod
+    def finish_cache(ffmpeg_process, cache_writer):
+        # decodes the rest of a track playback did not reach, so the next play of it is cached
+        while 1:
+            chunk = ffmpeg_process.stdout.read(1 << 16)
+            if not chunk:
+                break
+            cache_writer.write(chunk)
+        ffmpeg_process.stdout.close()
+        if ffmpeg_process.wait() == 0:
+            cache_writer.commit()
         else:
-            self.device.stop_stream()
-            self.unpaused.wait()
-            self.device.start_stream()
+            cache_writer.discard()
+
+    def close_source(self):
+        if self.cache_writer:
+            Thread(target=AudioPlayer.finish_cache, args=(self.ffmpeg_process, self.cache_writer), daemon=True).start()
+            self.cache_writer = None
+        elif self.ffmpeg_process:
+            if self.ffmpeg_process.poll() is None:
+                self.ffmpeg_process.kill()
+            self.data_stream.close()
+        self.ffmpeg_process = None
+        self.data_stream = None
 
     def stop_stream(self):
         self.stream_open.clear()
-        self.device.stop_stream()
-
-        if self.ffmpeg_process.poll():
-            self.ffmpeg_process.kill()
+        self.playing = False
 
-        if self.data_stream:
-            self.data_stream.flush()
-            self.data_stream = None
+        self.close_source()
+        self.pcm_data = None
+        self.next_audio = self.previous_source = self.track_boundary = None
 
     def close(self):
+        self.device.stop_stream()
         self.device.close()
         self.pyaudio.terminate()
 
-    def play(self):
+    def play(self, delay_time=None):
         self.idle.clear()
+        self.play_time = perf_counter() + (self.delay_time if delay_time is None else delay_time)
         Thread(target=self.play_thread).start()
 
     def play_thread(self):
-        sleep(self.delay_time)
+        # decoder thread, keeps the ring buffer full while the callback plays from it
         while self.stream_open.is_set():
-            self.play_chunk()
+            if not self.playing and perf_counter() >= self.play_time:
+                self.playing = True
+
+            seek_request = self.seek_request
+            if seek_request[0] != self.seek_handled:
+                if self.track_boundary is not None:
+                    # seeking in the track still playing after the decoder switched, the queued track follows it again
+                    self.track_boundary = None
+                    self.close_source()
+                    self.next_audio = self.filepath
+                    self.filepath, self.pcm_data = self.previous_source
+                seek_frame = self.open_source(seek_request[1])
+                self.seek_handled = seek_request[0]
+                self.flush = (self.seek_handled, self.buffer.write_count, seek_frame)
+                self.decoding = True
+
+            if not self.decoding:
+                # let the callback drain what is left
+                if self.playing and not self.buffer.count_readable():
+                    break
+                sleep(self.frame_time / 2)
+                continue
+
+            if self.buffer.count_writable() < self.chunk_size:
+                sleep(self.frame_time / 2)
+                continue
+            chunk = self.read_chunk()
+            if chunk:
+                self.buffer.write(chunk)
+            elif self.next_audio and self.track_boundary is None:
+                self.switch_to_queued_audio()
+            else:
+                self.decoding = False
+
         self.stop_stream()
-        self.time = 0
+        self.decoding = False
+        self.buffer.clear()
+        if self.underruns:
+            print(f'WARNING: Audio buffer ran empty {self.underruns} times.')
+        if self.first_sample_time is not None:
+            self.start_latency = self.first_sample_time - self.play_time
+            if self.start_latency > AudioPlayer.START_LATENCY_TARGET:
+                print(f'WARNING: Song started {self.start_latency * 1000:.1f} ms late.')
+        self.frames_played = 0
+        self.clock_reference = None
         self.idle.set()
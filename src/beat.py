@@ -1,7 +0,0 @@
-class Beat:
-    def __init__(self, time):
-        self.time = time
-        self.color = (255, 255, 255)
-
-    def set_color(self, color):
-        self.color = color
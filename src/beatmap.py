@@ -0,0 +1,119 @@
+from array import array
+from mmap import mmap, ACCESS_READ
+from os import close, replace
+from os.path import dirname
+from struct import Struct
+from sys import byteorder
+from tempfile import mkstemp
+
+from util import ALL_LAYERS
+
+# Maps start with a header giving each layer's beat count and where its sorted beat times are stored, followed by the
+# layers' sections of little endian float32 beat times. Maps written by ctaff are headerless beat records in time order,
+# these are converted when imported and can still be read
+MAGIC = b'RZMP'
+VERSION = 1
+HEADER = Struct('<4sHHf')  # magic, version, number of layers, duration (seconds)
+LAYER_ENTRY = Struct('<cII')  # layer id (ascii), number of beats, offset of beat times from start of file
+
+BEAT_RECORD = Struct('=cf')  # layer id (ascii), beat time (seconds)
+
+
+def read_header(f):
+    # layer -> (number of beats, offset) and duration, or None for a legacy map
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+        return None
+    _, version, num_layers, duration = HEADER.unpack(header)
+    if version > VERSION:
+        raise ValueError(f'map version {version} is newer than supported version {VERSION}')
+    entries = f.read(num_layers * LAYER_ENTRY.size)
+    layer_entries = {beat_layer.decode('ascii'): (num_beats, offset)
+                     for beat_layer, num_beats, offset in LAYER_ENTRY.iter_unpack(entries)}
+    return layer_entries, duration
+
+
+def read_map(map_filepath, layers=ALL_LAYERS):
+    with open(map_filepath, 'rb') as f:
+        header = read_header(f)
+        if header is None:
+            return read_legacy_map(f, layers)
+
+        # only the requested layers' sections are read
+        layer_entries = header[0]
+        layer_times = {}
+        for layer in layers:
+            times = array('f')
+            num_beats, offset = layer_entries.get(layer, (0, 0))
+            if num_beats:
+                f.seek(offset)
+                times.frombytes(f.read(num_beats * times.itemsize))
+                if byteorder == 'big':
+                    times.byteswap()
+            layer_times[layer] = times
+        return layer_times
+
+
+def read_legacy_map(f, layers=ALL_LAYERS):
+    layer_times = {layer: array('f') for layer in layers}
+    layer_ids = {layer.encode('ascii'): times for layer, times in layer_times.items()}
+
+    try:
+        data = mmap(f.fileno(), 0, access=ACCESS_READ)
+    except ValueError:  # empty map
+        return layer_times
+
+    with data, memoryview(data) as view:
+        records = view[:len(view) - len(view) % BEAT_RECORD.size]
+        for beat_layer, beat_time in BEAT_RECORD.iter_unpack(records):
+            times = layer_ids.get(beat_layer)
+            if times is not None:
+                times.append(beat_time)
+        records.release()
+
+    # ctaff writes beats in time order, sorting is a (stable) safety net and linear on sorted input
+    for layer, times in layer_times.items():
+        if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+            layer_times[layer] = array('f', sorted(times))
+
+    return layer_times
+
+
+def write_map(map_filepath, layer_times, duration):
+    offset = HEADER.size + len(layer_times) * LAYER_ENTRY.size
+    entries = []
+    sections = []
+    for layer, times in layer_times.items():
+        if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+            times = array('f', sorted(times))
+        elif byteorder == 'big':
+            times = array('f', times)
+        if byteorder == 'big':
+            times.byteswap()
+        entries.append(LAYER_ENTRY.pack(layer.encode('ascii'), len(times), offset))
+        sections.append(times)
+        offset += len(times) * times.itemsize
+
+    with open(map_filepath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(layer_times), duration))
+        f.write(b''.join(entries))
+        for times in sections:
+            times.tofile(f)
+
+
+def convert_map(legacy_filepath, map_filepath, duration):
+    # map_filepath is only replaced once the converted map is complete, so it can also be the legacy map itself. the
+    # partial file is unique, so conversions of the same audio running at once don't write over each other
+    file_descriptor, temp_filepath = mkstemp('.map.part', dir=dirname(map_filepath) or '.')
+    close(file_descriptor)
+    write_map(temp_filepath, read_map(legacy_filepath), duration)
+    replace(temp_filepath, map_filepath)
+
+
+def count_beats(map_filepath):
+    with open(map_filepath, 'rb') as f:
+        header = read_header(f)
+        if header is None:
+            return {layer: len(times) for layer, times in read_legacy_map(f).items()}
+    layer_entries = header[0]
+    return {layer: layer_entries.get(layer, (0, 0))[0] for layer in ALL_LAYERS}
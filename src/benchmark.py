@@ -0,0 +1,246 @@
+# Performance benchmarks, run from the base directory: python src/benchmark.py <benchmark>
+from argparse import ArgumentParser
+from os import environ, remove
+from random import Random
+from struct import pack, unpack
+from tempfile import mkstemp
+from threading import Event
+from time import perf_counter
+import tracemalloc
+
+from beatmap import convert_map, read_map
+from layer import Layer
+from text_cache import TextCache
+from util import ALL_LAYERS
+
+
+def write_synthetic_map(num_beats, beats_per_second=10.0, layers=ALL_LAYERS, seed=0):
+    rng = Random(seed)
+    fd, map_filepath = mkstemp(suffix='.map')
+    with open(fd, 'wb') as f:
+        beat_time = 0.0
+        for _ in range(num_beats):
+            beat_time += rng.expovariate(beats_per_second)
+            f.write(rng.choice(layers).encode('ascii') + pack('f', beat_time))
+    return map_filepath
+
+
+class LegacyBeat:
+    def __init__(self, time):
+        self.time = time
+        self.color = (255, 255, 255)
+
+
+def legacy_read_in_beats(map_filepath, enabled_layers=ALL_LAYERS):
+    layers = {layer: [] for layer in ALL_LAYERS}
+    with open(map_filepath, 'rb') as f:
+        while 1:
+            beat_layer = f.read(1).decode('ascii')
+            if not beat_layer:
+                break
+            beat_time = unpack('f', f.read(4))[0]
+
+            if beat_layer in enabled_layers:
+                layers[beat_layer].insert(0, LegacyBeat(beat_time))
+    return layers
+
+
+def read_in_beats(map_filepath, enabled_layers=ALL_LAYERS):
+    layers = {layer: Layer(layer, None) for layer in ALL_LAYERS}
+    for layer, beat_times in read_map(map_filepath, enabled_layers).items():
+        layers[layer].set_beats(beat_times)
+    return layers
+
+
+class StubAudioPlayer:
+    # stands in for AudioPlayer with a deterministic clock that only moves when advanced
+    def __init__(self, duration):
+        self.delay_time = 0
+        self.time = 0
+        self.duration = duration
+        self.stream_open = Event()
+        self.stream_open.set()
+        self.track_number = 0
+
+    def advance(self, seconds):
+        self.time += seconds
+        if self.time >= self.duration:
+            self.stream_open.clear()
+
+    def get_time(self):
+        return self.time
+
+    def seek(self, time):
+        self.time = time
+
+    def pause(self):
+        pass
+
+    def unpause(self):
+        pass
+
+
+class SimulatedClock:
+    def __init__(self, fps):
+        self.fps = fps
+
+    def tick(self, framerate=0):
+        return 1000 / self.fps
+
+    def get_fps(self):
+        return self.fps
+
+
+class StubTrack:
+    def __init__(self, map_filepath, duration):
+        self.map_filepath = map_filepath
+        self.title = 'Benchmark'
+        self.artist = 'rizumu'
+        self.album = 'Synthetic'
+        self.duration = duration
+        self.num_beats = {layer: len(times) for layer, times in read_map(map_filepath).items()}
+        self.high_score = 0
+
+
+def init_headless_display(width, height):
+    environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    import pygame
+    pygame.init()
+    return pygame.display.set_mode((width, height))
+
+
+def time_call(function, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function(*args)
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def benchmark_maps(sizes, legacy_limit):
+    print(f'{"beats":>10} {"legacy (s)":>12} {"vectorized (s)":>16} {"header (s)":>12} {"speedup":>9}')
+    for num_beats in sizes:
+        map_filepath = write_synthetic_map(num_beats)
+        header_map_filepath = f'{map_filepath}.header'
+        try:
+            new_time = time_call(read_in_beats, map_filepath)
+            convert_map(map_filepath, header_map_filepath, 0)
+            header_time = time_call(read_in_beats, header_map_filepath)
+            if num_beats <= legacy_limit:
+                legacy_time = time_call(legacy_read_in_beats, map_filepath, repeat=1)
+                print(f'{num_beats:>10} {legacy_time:>12.4f} {new_time:>16.4f} {header_time:>12.4f} {legacy_time / header_time:>8.1f}x')
+            else:
+                print(f'{num_beats:>10} {"skipped":>12} {new_time:>16.4f} {header_time:>12.4f} {"":>9}')
+        finally:
+            remove(map_filepath)
+            remove(header_map_filepath)
+
+
+def run_gameplay(screen, map_filepath, duration, layers, fps, preview_length=.5, autoplay=False, trace_allocations=False):
+    from game import Game
+
+    width, height = screen.get_size()
+    audio_player = StubAudioPlayer(duration)
+    keys = {layer: i for i, layer in enumerate(layers)}
+    game = Game(screen, width, height, audio_player, StubTrack(map_filepath, duration), keys,
+                preview_length, 0.06, True, False, None, TextCache())
+    game.clock = SimulatedClock(fps)
+    game.cheat = autoplay
+
+    frame_times = []
+    frame_allocations = []
+    if trace_allocations:
+        tracemalloc.start()
+    try:
+        while game.playing_screen:
+            if trace_allocations:
+                tracemalloc.reset_peak()
+                start_memory = tracemalloc.get_traced_memory()[0]
+            start = perf_counter()
+            game.draw_playing_screen()
+            frame_times.append(perf_counter() - start)
+            if trace_allocations:
+                frame_allocations.append(tracemalloc.get_traced_memory()[1] - start_memory)
+            audio_player.advance(1 / fps)
+    finally:
+        if trace_allocations:
+            tracemalloc.stop()
+
+    return game, frame_times, frame_allocations
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def benchmark_frames(densities, num_frames, preview_length, fps):
+    screen = init_headless_display(1080, 900)
+
+    print(f'{"beats/s":>8} {"mean frame (ms)":>16} {"max frame (ms)":>15}')
+    for beats_per_second in densities:
+        duration = num_frames / fps
+        map_filepath = write_synthetic_map(int(beats_per_second * (duration + preview_length)) + 1, beats_per_second)
+        try:
+            frame_times = run_gameplay(screen, map_filepath, duration, ALL_LAYERS, fps, preview_length)[1]
+            print(f'{beats_per_second:>8} {sum(frame_times) / len(frame_times) * 1000:>16.3f} {max(frame_times) * 1000:>15.3f}')
+        finally:
+            remove(map_filepath)
+
+
+def benchmark_gameplay(duration, beats_per_second, num_layers, fps, preview_length, autoplay):
+    screen = init_headless_display(1080, 900)
+    layers = ALL_LAYERS[:num_layers]
+
+    map_filepath = write_synthetic_map(int(beats_per_second * (duration + preview_length)) + 1, beats_per_second, layers)
+    try:
+        start = perf_counter()
+        game, frame_times, _ = run_gameplay(screen, map_filepath, duration, layers, fps, preview_length, autoplay)
+        wall_time = perf_counter() - start
+        frame_allocations = run_gameplay(screen, map_filepath, duration, layers, fps, preview_length, autoplay,
+                                         trace_allocations=True)[2]
+    finally:
+        remove(map_filepath)
+
+    print(f'simulated song time: {len(frame_times) / fps:.1f} s ({len(frame_times)} frames at {fps:g} fps, '
+          f'{beats_per_second:g} beats/s over {num_layers} layers)')
+    print(f'wall time: {wall_time:.2f} s ({len(frame_times) / fps / wall_time:.1f}x real time)')
+    print(f'score: {game.score}, perfect: {game.num_perfect}, missed: {game.num_missed}')
+    print('frame latency (ms): ' + ', '.join(f'p{fraction * 100:g} {percentile(frame_times, fraction) * 1000:.3f}'
+                                             for fraction in (.5, .9, .99, .999)) + f', max {max(frame_times) * 1000:.3f}')
+    print('allocated per frame (bytes): ' + ', '.join(f'p{fraction * 100:g} {percentile(frame_allocations, fraction)}'
+                                                      for fraction in (.5, .9, .99)) + f', max {max(frame_allocations)}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='rizumu performance benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    maps_parser = subparsers.add_parser('maps', help='beat map loading')
+    maps_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    maps_parser.add_argument('--legacy-limit', type=int, default=1_000_000,
+                             help='skip the quadratic legacy loader above this many beats')
+
+    frames_parser = subparsers.add_parser('frames', help='headless frame time against beat density')
+    frames_parser.add_argument('--densities', type=float, nargs='+', default=[10, 50, 100, 500, 1000])
+    frames_parser.add_argument('--frames', type=int, default=600)
+    frames_parser.add_argument('--preview-length', type=float, default=.5)
+    frames_parser.add_argument('--fps', type=float, default=144)
+
+    gameplay_parser = subparsers.add_parser('gameplay', help='headless gameplay loop with a simulated audio clock')
+    gameplay_parser.add_argument('--duration', type=float, default=60, help='simulated song length in seconds')
+    gameplay_parser.add_argument('--density', type=float, default=20, help='beats per second')
+    gameplay_parser.add_argument('--layers', type=int, default=len(ALL_LAYERS), choices=range(1, len(ALL_LAYERS) + 1))
+    gameplay_parser.add_argument('--fps', type=float, default=144)
+    gameplay_parser.add_argument('--preview-length', type=float, default=.5)
+    gameplay_parser.add_argument('--autoplay', action='store_true', help='hit every beat with the autoplayer')
+
+    args = parser.parse_args()
+    if args.benchmark == 'maps':
+        benchmark_maps(args.sizes, args.legacy_limit)
+    elif args.benchmark == 'frames':
+        benchmark_frames(args.densities, args.frames, args.preview_length, args.fps)
+    elif args.benchmark == 'gameplay':
+        benchmark_gameplay(args.duration, args.density, args.layers, args.fps, args.preview_length, args.autoplay)
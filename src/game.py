@@ -1,17 +1,29 @@
-from struct import unpack
+from array import array
+from math import floor
+from time import perf_counter
 
 import pygame
-from pygame.font import Font
 from pygame.time import Clock
 
-from layer import Layer
+from beatmap import read_map
+from input_queue import InputQueue
+from layer import Layer, IN_WINDOW
+from text_cache import load_font
 from util import ALL_LAYERS, seconds_to_readable_time
 
 
 class Game:
-    def __init__(self, screen, width, height, audio_player, track, enabled_layers_keys, preview_length, lenience, prune_unused_layers, latency, play_hit_sound, hit_sound_data):
+
+    SIMULATION_STEP = .001  # seconds of song time per gameplay step
+    PRESENT_MARGIN = .002  # seconds before the expected end of presenting a frame that polling stops
+    HIT_TEXT_DURATION = .5  # seconds of song time a judgment stays up
+
+    def __init__(self, screen, width, height, audio_player, track, enabled_layers_keys, preview_length, lenience, prune_unused_layers, play_hit_sound, hit_sounds, text_cache, start_time=0, speed=1, layer_beats=None, previous_game=None, show_score=True, max_frame_rate=0, loop_start=None, loop_end=None):
         self.audio_player = audio_player
         self.track = track
+        # at other speeds the game runs in time of the stretched audio, so beat times, windows and scrolling are scaled
+        self.speed = speed
+        self.duration = track.duration / speed
         self.layers = {}
         self.key_to_layer = {}
         self.enabled_layers_keys = enabled_layers_keys
@@ -25,7 +37,7 @@ class Game:
                 self.key_to_layer[key] = layer_object
 
         self.total_num_beats = 0
-        self.read_in_beats(self.track.map_filepath)
+        self.read_in_beats(self.track.map_filepath, layer_beats)
 
         self.num_layers = max(len(self.layers.keys()), 1)
 
@@ -34,17 +46,18 @@ class Game:
         self.height = height
         self.track_height = self.height - 150
         self.bottom_offset = self.height - self.track_height
-        self.preview_length = preview_length  # seconds
-        self.lenience = lenience
+        self.preview_length = preview_length / speed  # seconds
+        self.lenience = lenience / speed
 
         self.pixels_per_second = self.track_height / self.preview_length
 
         self.screen = screen
+        self.text_cache = text_cache
 
-        self.huge_font = Font('font/unifont.ttf', 64)
-        self.large_font = Font('font/unifont.ttf', 36)
-        self.generic_font = Font('font/unifont.ttf', 26)
-        self.small_font = Font('font/unifont.ttf', 20)
+        self.huge_font = load_font(64)
+        self.large_font = load_font(36)
+        self.generic_font = load_font(26)
+        self.small_font = load_font(20)
 
         self.beat_width = self.track_height / self.num_layers // 3
         self.beat_height = self.pixels_per_second * self.lenience // 2  # height of perfect window
@@ -54,10 +67,9 @@ class Game:
                               for i in range(0, self.num_layers)]
 
         self.clock = Clock()
+        self.max_frame_rate = max_frame_rate  # 0 draws as fast as possible, gameplay steps at the same rate either way
 
-        self.latency = latency
-        self.extra_time = latency + 0.5  # extra time after track ends to keep drawing main screen
-        self.average_time_difference = 0
+        self.extra_time = 0.5  # extra time after track ends to keep drawing main screen
 
         self.score = 0
         self.num_perfect = self.num_great = self.num_ok = self.num_missed = 0
@@ -67,20 +79,48 @@ class Game:
         self.missed_color = (255, 128, 128)
         self.white = (255, 255, 255)
 
+        self.beat_surface = pygame.Surface((self.beat_width, self.beat_height))
+        self.beat_surface.fill(self.white)
+        self.great_beat_surface = pygame.Surface((self.beat_width, self.beat_height))
+        self.great_beat_surface.fill(self.great_color)
+        self.shadow_surface = pygame.Surface((self.beat_width, self.beat_height))
+        self.shadow_surface.fill(self.missed_color)
+
         self.combo = 0
         self.combo_multiplier = 1.0
 
-        self.hit_text_frames = 0
-        self.hit_text_max_frames = 30
-
-        self.hit_text = None
-        self.hit_text_box = None
-
-        self.track_title_text = self.small_font.render(f'{self.track.title}', True, self.white)
-        self.track_artist_text = self.small_font.render(f'{self.track.artist}', True, self.white)
-        self.track_album_text = self.small_font.render(f'{self.track.album}', True, self.white)
+        # in a marathon score and combo carry over from the previous track, and only the last one shows the score screen
+        if previous_game:
+            self.score = previous_game.score
+            self.num_perfect, self.num_great, self.num_ok, self.num_missed = previous_game.num_perfect, previous_game.num_great, previous_game.num_ok, previous_game.num_missed
+            self.combo = previous_game.combo
+        self.update_combo_multiplier()
+        self.start_counts = self.score, self.num_perfect, self.num_great, self.num_ok, self.num_missed
+        self.show_score = show_score
+        self.finished = False  # played to the end
+        self.track_number = 0  # of the audio player's track this game plays
+        self.next_started = False  # the track queued after this one took over the stream without a gap
+
+        self.hit_text = None  # (text, color) of the last judgment
+        self.hit_text_time = 0  # song time it was made at
+
+        self.track_title_text = self.text_cache.render(self.small_font, f'{self.track.title}', self.white)
+        self.track_artist_text = self.text_cache.render(self.small_font, f'{self.track.artist}', self.white)
+        self.track_album_text = self.text_cache.render(self.small_font, f'{self.track.album}', self.white)
+
+        # Static geometry and labels, rebuilt on resize. layer lines change thickness with key presses, so they're drawn
+        # over the playfield each frame from prebuilt surfaces
+        self.background = None
+        self.layer_lines = {}  # (layer, line thickness) -> surface
+        self.playfield_rect = pygame.Rect(0, 0, self.track_width + 1, self.height)
+        self.hud_rects = []
+        self.full_redraw = True
 
         self.paused = False
+        self.input_queue = InputQueue()
+        self.present_end = perf_counter()  # when presenting the last frame returned
+        self.present_period = 0  # smoothed time between presents, the refresh period while presenting waits for vsync
+        self.simulation_tick = 0  # last gameplay step simulated, in SIMULATION_STEPs of song time
 
         self.time = 0
         self.playing_screen = True
@@ -91,21 +131,25 @@ class Game:
         self.draw_score = True
 
         self.play_hit_sound = play_hit_sound
-        self.hit_sound_data = hit_sound_data
+        self.hit_sounds = hit_sounds  # layer -> hit sound name
 
         self.cheat = False
         self.cheated = False
 
-    def read_in_beats(self, map_filepath):
-        with open(map_filepath, 'rb') as f:
-            while 1:
-                beat_layer = f.read(1).decode('ascii')
-                if not beat_layer:
-                    break
-                beat_time = unpack('f', f.read(4))[0]
-
-                if beat_layer in self.enabled_layers:
-                    self.layers[beat_layer].insert_beat(beat_time)
+        # practice, starting part way in or looping a section, doesn't count toward the high score
+        self.start_time = start_time
+        self.loop_start = loop_start
+        self.loop_end = loop_end
+        self.practiced = start_time > 0 or loop_start is not None
+
+    def read_in_beats(self, map_filepath, layer_beats=None):
+        if layer_beats is None:
+            layer_beats = read_map(map_filepath, self.enabled_layers)
+        for layer, beat_times in layer_beats.items():
+            # prefetched beats may be shared with the caller, so they're scaled into a new array
+            if self.speed != 1:
+                beat_times = array('f', (beat_time / self.speed for beat_time in beat_times))
+            self.layers[layer].set_beats(beat_times)
 
         for layer in ALL_LAYERS:
             layer_object = self.layers[layer]
@@ -116,254 +160,329 @@ class Game:
 
         self.total_num_beats = sum((self.track.num_beats[layer] for layer in self.enabled_layers))
 
+    def build_background(self):
+        self.background = pygame.Surface((self.width, self.height))
+
+        # Draw borders
+        pygame.draw.line(self.background, (128, 128, 128), (0, 0), (0, self.height), 1)
+        pygame.draw.line(self.background, (128, 128, 128), (self.track_width, 0), (self.track_width, self.height), 1)
+        pygame.draw.line(self.background, (128, 128, 128), (self.width - 1, 0), (self.width - 1, self.height), 1)
+
+        # Draw 1/3 and 2/3 reference lines
+        pygame.draw.line(self.background, (128, 128, 128), (0, self.track_height / 3),
+                         (self.track_width, self.track_height / 3), 1)
+        pygame.draw.line(self.background, (128, 128, 128), (0, 2 * self.track_height / 3),
+                         (self.track_width, 2 * self.track_height / 3), 1)
+
+        # Draw baseline
+        pygame.draw.line(self.background, (192, 192, 192), (0, self.track_height), (self.track_width, self.track_height), 5)
+
+        # Draw track info labels
+        self.background.blit(self.track_title_text, (self.track_width + 20, self.height * .05))
+        self.background.blit(self.track_artist_text, (self.track_width + 20, self.height * .1))
+        self.background.blit(self.track_album_text, (self.track_width + 20, self.height * .15))
+
+    def get_layer_line(self, layer_object):
+        key = layer_object.layer_id, layer_object.line_thickness
+        surface = self.layer_lines.get(key)
+        if surface is None:
+            surface = pygame.Surface((layer_object.line_thickness, self.track_height))
+            surface.fill(layer_object.color)
+            self.layer_lines[key] = surface
+        return surface
+
     def score_beat(self, time_difference):
         if time_difference < self.lenience / 4:
             self.score += int(30 * self.combo_multiplier)
             self.num_perfect += 1
             self.combo += 5
+            self.update_combo_multiplier()
             return 'PERFECT!', self.perfect_color
         elif time_difference < self.lenience / 2:
             self.score += int(20 * self.combo_multiplier)
             self.num_great += 1
             self.combo += 2
+            self.update_combo_multiplier()
             return 'GREAT!', self.great_color
         else:
             self.score += int(10 * self.combo_multiplier)
             self.num_ok += 1
             self.combo += 1
+            self.update_combo_multiplier()
             return 'OK!', self.ok_color
 
+    def update_combo_multiplier(self):
+        if self.combo >= 225:
+            self.combo_multiplier = 2.0
+        elif self.combo >= 150:
+            self.combo_multiplier = 1.5
+        elif self.combo >= 75:
+            self.combo_multiplier = 1.2
+        else:
+            self.combo_multiplier = 1.0
+
+    def miss_beats(self, layer_object, time):
+        # beats too far behind time to be hit become shadows
+        while layer_object.count_remaining_beats() > 0 and time - layer_object.next_beat_time() > self.lenience:
+            layer_object.miss_next_beat()
+            self.num_missed += 1
+            self.combo = 0
+            self.combo_multiplier = 1.0
+            self.hit_text = 'MISS!', self.missed_color
+            self.hit_text_time = time
+
+    def hit_beat(self, layer_object, time_difference, time):
+        self.hit_text = self.score_beat(time_difference)
+        self.hit_text_time = time
+        layer_object.hit_next_beat()
+
+        if self.play_hit_sound:
+            self.audio_player.play_hit_sound(self.hit_sounds[layer_object.layer_id], time)
+
     def calculate_accuracy(self):
         num_hit = self.num_perfect + self.num_great + self.num_ok
         return num_hit / max(1, self.num_missed + num_hit) * 100
 
-    def draw_playing_screen(self):
-        if not self.paused:
-            # Calculate time
-            audio_player_time = self.audio_player.get_time()
-
-            # if track not over, subtly correct time inaccuracies
-            if self.audio_player.stream_open.is_set():
-                if audio_player_time != 0:
-                    self.average_time_difference += (audio_player_time - self.time - self.average_time_difference) * .02
-                    self.time += self.average_time_difference * .05
-
-            current_song_time = self.time - self.latency
-
-            # Reset screen
-            self.screen.fill((0, 0, 0))
-
-            # Draw borders
-            pygame.draw.line(self.screen, (128, 128, 128), (0, 0), (0, self.height), 1)
-            pygame.draw.line(self.screen, (128, 128, 128), (self.track_width, 0), (self.track_width, self.height), 1)
-            pygame.draw.line(self.screen, (128, 128, 128), (self.width - 1, 0), (self.width - 1, self.height), 1)
-
-            # Draw 1/3 and 2/3 reference lines
-            pygame.draw.line(self.screen, (128, 128, 128), (0, self.track_height / 3),
-                             (self.track_width, self.track_height / 3), 1)
-            pygame.draw.line(self.screen, (128, 128, 128), (0, 2 * self.track_height / 3),
-                             (self.track_width, 2 * self.track_height / 3), 1)
-
-            # Draw baseline
-            pygame.draw.line(self.screen, (192, 192, 192), (0, self.track_height), (self.track_width, self.track_height), 5)
-
-            # Draw combo progress bar
-            if self.combo >= 225:
-                self.combo_multiplier = 2.0
-            elif self.combo >= 150:
-                self.combo_multiplier = 1.5
-            elif self.combo >= 75:
-                self.combo_multiplier = 1.2
+    def record_high_score(self):
+        # only what was scored on this track counts, not the totals carried over in a marathon
+        if self.cheated or self.practiced:
+            return
+        start_score, start_perfect, start_great, start_ok, start_missed = self.start_counts
+        score = self.score - start_score
+        num_hit = self.num_perfect + self.num_great + self.num_ok - start_perfect - start_great - start_ok
+        accuracy = num_hit / max(1, self.num_missed - start_missed + num_hit) * 100
+        layers = ''.join((sorted(self.enabled_layers_keys.keys())))
+        if self.speed != 1:
+            if score > self.track.get_practice_high_score(self.speed)[0]:
+                self.track.set_practice_high_score(self.speed, score, accuracy, layers)
+        elif score > self.track.high_score:
+            self.track.set_high_score(score)
+            self.track.set_high_score_accuracy(accuracy)
+            self.track.set_high_score_layers(layers)
+
+    def seek(self, time):
+        # beats skipped over are neither hit nor missed
+        time = min(max(0, time), self.duration)
+        self.audio_player.seek(time)
+        for layer_object in self.layers.values():
+            layer_object.seek(time)
+        self.time = time
+        self.simulation_tick = floor(time / Game.SIMULATION_STEP)
+        self.combo = 0
+        self.combo_multiplier = 1.0
+        self.hit_text = None
+        self.practiced = True
+
+    def simulate(self, song_time, frame_stamp):
+        # gameplay advances in fixed steps of song time driven by the audio clock, so judging, misses and autoplay
+        # come out the same at any frame rate, and drawing only reads the state. returns False once the game is paused
+        # or closed
+        events = self.input_queue.get()
+        try:
+            end_tick = floor(song_time / Game.SIMULATION_STEP)
+            while self.simulation_tick < end_tick:
+                self.simulation_tick += 1
+                step_time = self.simulation_tick * Game.SIMULATION_STEP
+
+                # each key press is handled in the step it arrived in and judged at the song time it arrived at
+                while events and song_time - (frame_stamp - events[0][0]) <= step_time:
+                    event_stamp, event = events.popleft()
+                    if not self.handle_event(event, song_time - (frame_stamp - event_stamp)):
+                        return False
+
+                for layer_object in self.layers.values():
+                    # Autoplayer
+                    while self.cheat and layer_object.count_remaining_beats() > 0 and layer_object.next_beat_time() <= step_time:
+                        self.hit_beat(layer_object, step_time - layer_object.next_beat_time(), step_time)
+
+                    self.miss_beats(layer_object, step_time)
+
+            step_time = self.simulation_tick * Game.SIMULATION_STEP
+            shadow_end_time = step_time - self.bottom_offset / self.pixels_per_second
+            for layer_object in self.layers.values():
+                layer_object.enter_window(step_time + self.lenience * .25)
+                layer_object.remove_shadows(shadow_end_time)
+            return True
+        finally:
+            # presses that arrived after the last step are handled in the next frame's steps
+            self.input_queue.put_back(events)
+
+    def handle_event(self, event, event_time):
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE or event.key == pygame.K_SPACE:
+                if event_time > 0:
+                    self.paused = True
+                    self.audio_player.pause()
+                else:
+                    self.close_game()
+                return False
+            elif event.key == pygame.K_TAB:
+                self.cheated = True
+                self.cheat = not self.cheat
             else:
-                self.combo_multiplier = 1.0
-
-            pygame.draw.line(self.screen, self.white, (0, self.track_height), (self.track_width * min(225, self.combo) / 225, self.track_height), 7)
-            if self.combo < 225:
-                pygame.draw.line(self.screen, (0, 0, 0), (self.track_width / 3, self.track_height - 3), (self.track_width / 3, self.track_height + 3), 7)
-                pygame.draw.line(self.screen, (0, 0, 0), (self.track_width * 2 / 3, self.track_height - 3), (self.track_width * 2 / 3, self.track_height + 3), 7)
-
-            # Draw progress bar
-            pygame.draw.line(self.screen, self.white, (0, self.height - 3), (self.track_width * min(1, (current_song_time if current_song_time > 0 else 0) / self.track.duration), self.height - 3), 5)
-
-            # Draw track info labels
-            self.screen.blit(self.track_title_text, (self.track_width + 20, self.height * .05))
-            self.screen.blit(self.track_artist_text, (self.track_width + 20, self.height * .1))
-            self.screen.blit(self.track_album_text, (self.track_width + 20, self.height * .15))
-
-            # Draw realtime score labels
-            score_text = self.large_font.render(f'{self.score} × {self.combo_multiplier:.1f}', True, self.white if not self.cheated else self.missed_color)
-            self.screen.blit(score_text, (self.track_width + 20, self.height * .2))
-
-            accuracy_text = self.large_font.render(f'{self.calculate_accuracy():.3f}%', True, self.white)
-            self.screen.blit(accuracy_text, (self.track_width + 20, self.height * .275))
-
-            num_perfect_text = self.large_font.render(f'{self.num_perfect}', True, self.perfect_color)
-            self.screen.blit(num_perfect_text, (self.track_width + 20, self.height * .35))
-
-            num_great_text = self.large_font.render(f'{self.num_great}', True, self.great_color)
-            self.screen.blit(num_great_text, (self.track_width + 110, self.height * .35))
-
-            num_ok_text = self.large_font.render(f'{self.num_ok}', True, self.ok_color)
-            self.screen.blit(num_ok_text, (self.track_width + 200, self.height * .35))
-
-            num_missed_text = self.large_font.render(f'{self.num_missed}', True, self.missed_color)
-            self.screen.blit(num_missed_text, (self.track_width + 290, self.height * .35))
-
-            # Draw time
-            time_text = self.huge_font.render(f'{seconds_to_readable_time(current_song_time)}', True, self.white)
-            time_text_box = time_text.get_rect()
-            time_text_box.center = self.track_width + (self.width - self.track_width) / 2, self.height * .5
-            self.screen.blit(time_text, time_text_box)
+                layer_object = self.key_to_layer.get(event.key, None)
+                if layer_object:
+                    layer_object.set_line_thickness(7)
+                    self.miss_beats(layer_object, event_time)
+                    if layer_object.count_remaining_beats() > 0:
+                        time_difference = abs(layer_object.next_beat_time() - event_time)
+                        if time_difference <= self.lenience:
+                            self.hit_beat(layer_object, time_difference, event_time)
+
+        elif event.type == pygame.KEYUP:
+            for layer in self.enabled_layers:
+                layer_object = self.layers[layer]
+                if event.key == layer_object.key:
+                    layer_object.set_line_thickness(3)
+                    break
 
-            # Draw fps
-            fps_text = self.small_font.render(f'{self.clock.get_fps():.1f}', True, self.white)
-            self.screen.blit(fps_text, (self.width - 55, 10))
+        elif event.type == pygame.WINDOWSIZECHANGED:
+            self.background = None
 
-            # Draw track and beats
-            missed = False
-            for layer, center in zip(sorted(self.layers.keys()), self.layer_centers):
-                layer_object = self.layers[layer]
+        elif event.type == pygame.QUIT:
+            self.close_game()
+            self.score_screen = True
+            return False
+        return True
 
-                # Draw layer track
-                pygame.draw.line(self.screen, layer_object.color, (center, 0), (center, self.track_height), layer_object.line_thickness)
-
-                # Draw beats
-                for i in range(layer_object.count_remaining_beats() - 1, -1, -1):
-                    beat = layer_object.get_beat(i)
-                    if beat.time - (self.beat_height / self.pixels_per_second / 2) <= current_song_time + self.preview_length:
-                        # Autoplayer
-                        if self.cheat:
-                            time_difference = abs(layer_object.get_beat(-1).time - current_song_time)
-                            if time_difference <= .015:
-                                beat_accuracy, color = self.score_beat(time_difference)
-                                layer_object.remove_last_beat()
-                            
-                                self.hit_text = self.large_font.render(beat_accuracy, True, color)
-                                self.hit_text_box = self.hit_text.get_rect()
-                                self.hit_text_frames = 0
-                            
-                                if self.play_hit_sound:
-                                    layer_id = layer_object.layer_id
-                                    if layer_id in ('A', 'B'):
-                                        index = 0
-                                    else:  # layer_id in ('C', 'D', 'E', 'F')
-                                        index = 1
-                            
-                                    if not pygame.mixer.Channel(index).get_busy():
-                                        pygame.mixer.Channel(index).play(self.hit_sound_data[index])
-
-                        if abs(current_song_time - beat.time) <= self.lenience * .25:
-                            beat.set_color(self.great_color)
-                        elif current_song_time - beat.time > self.lenience:  # missed, convert to shadow
-                            beat.set_color(self.missed_color)
-                            layer_object.insert_shadow(beat)
-                            layer_object.remove_last_beat()
-
-                            self.num_missed += 1
-                            missed = True
-
-                        pygame.draw.rect(self.screen, beat.color,
-                                         (center - self.beat_width / 2,
-                                          self.pixels_per_second * (self.preview_length - beat.time + current_song_time) - self.beat_height / 2,
-                                          self.beat_width,
-                                          self.beat_height))
-                    else:
-                        break
-
-                # Draw shadows
-                if layer_object.count_shadows() > 0:
-                    for shadow in layer_object.shadows:
-                        pygame.draw.rect(self.screen, shadow.color,
-                                         (center - self.beat_width / 2,
-                                          self.pixels_per_second * (self.preview_length - shadow.time + current_song_time) - self.beat_height / 2,
-                                          self.beat_width,
-                                          self.beat_height))
-
-                    if current_song_time - self.bottom_offset / self.pixels_per_second > layer_object.shadows[-1].time:
-                        layer_object.remove_last_shadow()
-
-            # Check events
-            for event in pygame.event.get():
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE or event.key == pygame.K_SPACE:
-                        if current_song_time > 0:
-                            self.paused = True
-                            self.audio_player.pause()
-                        else:
-                            self.close_game()
-                            return
-                    elif event.key == pygame.K_TAB:
-                        self.cheated = True
-                        self.cheat = not self.cheat
-                    else:
-                        layer_object = self.key_to_layer.get(event.key, None)
-                        if layer_object:
-                            layer_object.set_line_thickness(7)
-                            if layer_object.count_remaining_beats() > 0:
-                                time_difference = abs(layer_object.get_beat(-1).time - current_song_time)
-                                if time_difference <= self.lenience:
-                                    beat_accuracy, color = self.score_beat(time_difference)
-                                    layer_object.remove_last_beat()
-
-                                    self.hit_text = self.large_font.render(beat_accuracy, True, color)
-                                    self.hit_text_box = self.hit_text.get_rect()
-                                    self.hit_text_frames = 0
-
-                                    if self.play_hit_sound:
-                                        layer_id = layer_object.layer_id
-                                        if layer_id in ('A', 'B'):
-                                            index = 0
-                                        else:  # layer_id in ('C', 'D', 'E', 'F')
-                                            index = 1
-
-                                        if not pygame.mixer.Channel(index).get_busy():
-                                            pygame.mixer.Channel(index).play(self.hit_sound_data[index])
-
-                elif event.type == pygame.KEYUP:
-                    for layer in self.enabled_layers:
-                        layer_object = self.layers[layer]
-                        if event.key == layer_object.key:
-                            layer_object.set_line_thickness(3)
-                            break
-
-                elif event.type == pygame.QUIT:
-                    self.close_game()
-                    self.score_screen = True
-                    return
+    def draw_frame(self, current_song_time):
+        # draws the playfield and hud at a song time, returns the rects to present
 
-            if missed:
-                self.hit_text = self.large_font.render('MISS!', True, self.missed_color)
-                self.hit_text_box = self.hit_text.get_rect()
-                self.hit_text_frames = 0
+        # Restore static background where the last frame drew
+        if self.background is None:
+            self.build_background()
+            self.screen.blit(self.background, (0, 0))
+            self.full_redraw = True
+        else:
+            self.screen.blit(self.background, self.playfield_rect, self.playfield_rect)
+            for rect in self.hud_rects:
+                self.screen.blit(self.background, rect, rect)
+        dirty_rects = [self.playfield_rect] + self.hud_rects
+        self.hud_rects = []
+
+        # Draw layer lines
+        layer_line_blits = []
+        for layer, center in zip(sorted(self.layers.keys()), self.layer_centers):
+            layer_object = self.layers[layer]
+            layer_line_blits.append((self.get_layer_line(layer_object), (center - layer_object.line_thickness // 2, 0)))
+        self.screen.fblits(layer_line_blits)
+
+        # Draw combo progress bar
+        pygame.draw.line(self.screen, self.white, (0, self.track_height), (self.track_width * min(225, self.combo) / 225, self.track_height), 7)
+        if self.combo < 225:
+            pygame.draw.line(self.screen, (0, 0, 0), (self.track_width / 3, self.track_height - 3), (self.track_width / 3, self.track_height + 3), 7)
+            pygame.draw.line(self.screen, (0, 0, 0), (self.track_width * 2 / 3, self.track_height - 3), (self.track_width * 2 / 3, self.track_height + 3), 7)
+
+        # Draw progress bar
+        pygame.draw.line(self.screen, self.white, (0, self.height - 3), (self.track_width * min(1, (current_song_time if current_song_time > 0 else 0) / self.duration), self.height - 3), 5)
+        for loop_time in (self.loop_start, self.loop_end):
+            if loop_time is not None:
+                loop_x = self.track_width * min(1, loop_time / self.duration)
+                pygame.draw.line(self.screen, self.missed_color, (loop_x, self.height - 12), (loop_x, self.height), 3)
+
+        # Draw realtime score labels
+        hud_x = self.track_width + 20
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.large_font, f'{self.score} × {self.combo_multiplier:.1f}', self.white if not self.cheated and not self.practiced else self.missed_color, (hud_x, self.height * .2)))
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.large_font, f'{self.calculate_accuracy():.3f}%', self.white, (hud_x, self.height * .275)))
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.large_font, f'{self.num_perfect}', self.perfect_color, (hud_x, self.height * .35)))
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.large_font, f'{self.num_great}', self.great_color, (hud_x + 90, self.height * .35)))
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.large_font, f'{self.num_ok}', self.ok_color, (hud_x + 180, self.height * .35)))
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.large_font, f'{self.num_missed}', self.missed_color, (hud_x + 270, self.height * .35)))
+
+        # Draw time
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.huge_font, seconds_to_readable_time(current_song_time), self.white,
+                                                          (self.track_width + (self.width - self.track_width) / 2, self.height * .5), centered=True))
+
+        # Draw fps
+        self.hud_rects.append(self.text_cache.blit_glyphs(self.screen, self.small_font, f'{self.clock.get_fps():.1f}', self.white, (self.width - 55, 10)))
+
+        # Draw beats
+        beat_blits = []
+        beat_offset = self.pixels_per_second * (self.preview_length + current_song_time) - self.beat_height / 2
+        preview_end_time = current_song_time + self.preview_length + self.beat_height / self.pixels_per_second / 2
+        for layer, center in zip(sorted(self.layers.keys()), self.layer_centers):
+            layer_object = self.layers[layer]
+            beat_x = center - self.beat_width / 2
+
+            # Draw beats, those that have been inside the perfect window highlighted
+            beat_states = layer_object.beat_states
+            beat_times = layer_object.beat_times
+            visible_end = layer_object.find_beats(current_song_time, preview_end_time)[1]
+            beat_blits += [(self.great_beat_surface if beat_states[i] == IN_WINDOW else self.beat_surface,
+                            (beat_x, beat_offset - self.pixels_per_second * beat_times[i]))
+                           for i in range(layer_object.cursor, visible_end)]
+
+            # Draw shadows
+            if layer_object.count_shadows() > 0:
+                beat_blits += [(self.shadow_surface, (beat_x, beat_offset - self.pixels_per_second * layer_object.get_shadow_time(i)))
+                               for i in range(layer_object.count_shadows())]
+
+        self.screen.fblits(beat_blits)
+        self.input_queue.poll()
+
+        # Draw hit text, rising for as long as it's up
+        hit_text_age = current_song_time - self.hit_text_time
+        if self.hit_text and 0 <= hit_text_age <= Game.HIT_TEXT_DURATION:
+            hit_text = self.text_cache.render(self.large_font, *self.hit_text)
+            hit_text_box = hit_text.get_rect(center=(self.track_width / 2, self.height - 50 - 15 * hit_text_age / Game.HIT_TEXT_DURATION))
+            self.screen.blit(hit_text, hit_text_box)
+
+        return dirty_rects
+
+    def present(self, dirty_rects):
+        if self.full_redraw:
+            pygame.display.flip()
+            self.full_redraw = False
+        else:
+            pygame.display.update(dirty_rects + self.hud_rects)
 
-                self.combo = 0
+    def draw_playing_screen(self):
+        if self.audio_player.track_number != self.track_number:
+            self.playing_screen = False
+            self.score_screen = self.show_score
+            self.finished = self.next_started = True
+            return
 
-            # Draw hit text
-            if self.hit_text:
-                self.hit_text_box.center = self.track_width / 2, self.height - 50 - self.hit_text_frames / 2
-                self.screen.blit(self.hit_text, self.hit_text_box)
-                self.hit_text_frames += 1
-                if self.hit_text_frames > self.hit_text_max_frames:
-                    self.hit_text_frames = 0
-                    self.hit_text = None
+        if not self.paused:
+            # the audio clock already accounts for output latency, after the track ends the frame clock takes over
+            if self.audio_player.stream_open.is_set():
+                self.time = self.audio_player.get_time()
+            frame_stamp = perf_counter()
+            if self.loop_end is not None and self.time >= self.loop_end:
+                self.seek(self.loop_start)
+            current_song_time = self.time
 
-            # Update display
-            pygame.display.flip()
+            if not self.simulate(current_song_time, frame_stamp):
+                return
 
-            # better frame accuracy, uses more CPU
-            # self.time += self.clock.tick_busy_loop(60) / 1000
+            # with vsync presenting blocks until the next refresh and input arriving meanwhile is only stamped once it
+            # returns, so without a frame rate cap input is polled until just before the refresh is due
+            dirty_rects = self.draw_frame(current_song_time)
+            if not self.max_frame_rate:
+                self.input_queue.wait(self.present_end + self.present_period - Game.PRESENT_MARGIN)
+            self.present(dirty_rects)
+            present_end = perf_counter()
+            self.present_period += (present_end - self.present_end - self.present_period) * .1
+            self.present_end = present_end
+
+            if self.max_frame_rate:
+                self.input_queue.wait(frame_stamp + 1 / self.max_frame_rate)
+            else:
+                self.input_queue.poll()
             tick = self.clock.tick() / 1000
-            # if self.audio_player.stream_open.is_set():
-            self.time += tick
             # if track is over, set screen to score screen after extra_time elapses
             if not self.audio_player.stream_open.is_set():
+                self.time += tick
                 self.extra_time -= tick
                 if self.extra_time <= 0:
                     self.playing_screen = False
-                    self.score_screen = True
+                    self.score_screen = self.show_score
+                    self.finished = True
 
         else:
-            for event in pygame.event.get():
+            # seeks and loop edits are shown while paused
+            redraw = False
+            for _, event in self.input_queue.get():
                 if event.type == pygame.QUIT:
                     self.close_game()
                     return
@@ -379,7 +498,31 @@ class Game:
                     elif event.key == pygame.K_BACKSPACE:
                         self.close_game()
                         return
-
+                    elif event.key == pygame.K_LEFT:
+                        self.seek(self.time - 5)
+                        redraw = True
+                    elif event.key == pygame.K_RIGHT:
+                        self.seek(self.time + 5)
+                        redraw = True
+                    elif event.key == pygame.K_a:
+                        self.loop_start = self.time
+                        if self.loop_end is not None and self.loop_end <= self.loop_start:
+                            self.loop_end = None
+                        self.practiced = True
+                        redraw = True
+                    elif event.key == pygame.K_b:
+                        if self.loop_start is None:
+                            self.loop_start = 0
+                        if self.time > self.loop_start:
+                            self.loop_end = self.time
+                            self.practiced = True
+                            redraw = True
+                    elif event.key == pygame.K_c:
+                        self.loop_start = self.loop_end = None
+                        redraw = True
+
+            if redraw:
+                self.present(self.draw_frame(self.time))
             self.clock.tick(30)
 
     def draw_score_screen(self):
@@ -387,32 +530,32 @@ class Game:
             self.screen.fill((0, 0, 0))
             self.draw_score = False
 
-            final_score_perfect_text = self.large_font.render(f'perfect: {self.num_perfect}', True, self.perfect_color)
+            final_score_perfect_text = self.text_cache.render(self.large_font, f'perfect: {self.num_perfect}', self.perfect_color)
             final_score_perfect_text_box = final_score_perfect_text.get_rect()
             final_score_perfect_text_box.center = self.width / 2, self.height / 2 - 250
             self.screen.blit(final_score_perfect_text, final_score_perfect_text_box)
 
-            final_score_great_text = self.large_font.render(f'great: {self.num_great}', True, self.great_color)
+            final_score_great_text = self.text_cache.render(self.large_font, f'great: {self.num_great}', self.great_color)
             final_score_great_text_box = final_score_great_text.get_rect()
             final_score_great_text_box.center = self.width / 2, self.height / 2 - 200
             self.screen.blit(final_score_great_text, final_score_great_text_box)
 
-            final_score_ok_text = self.large_font.render(f'ok: {self.num_ok}', True, self.ok_color)
+            final_score_ok_text = self.text_cache.render(self.large_font, f'ok: {self.num_ok}', self.ok_color)
             final_score_ok_text_box = final_score_ok_text.get_rect()
             final_score_ok_text_box.center = self.width / 2, self.height / 2 - 150
             self.screen.blit(final_score_ok_text, final_score_ok_text_box)
 
-            final_score_missed_text = self.large_font.render(f'missed: {self.num_missed}', True, self.missed_color)
+            final_score_missed_text = self.text_cache.render(self.large_font, f'missed: {self.num_missed}', self.missed_color)
             final_score_missed_text_box = final_score_missed_text.get_rect()
             final_score_missed_text_box.center = self.width / 2, self.height / 2 - 100
             self.screen.blit(final_score_missed_text, final_score_missed_text_box)
 
-            final_score_accuracy_text = self.large_font.render(f'accuracy: {self.calculate_accuracy():.3f}%', True, self.white)
+            final_score_accuracy_text = self.text_cache.render(self.large_font, f'accuracy: {self.calculate_accuracy():.3f}%', self.white)
             final_score_accuracy_text_box = final_score_accuracy_text.get_rect()
             final_score_accuracy_text_box.center = self.width / 2, self.height / 2 + 20
             self.screen.blit(final_score_accuracy_text, final_score_accuracy_text_box)
 
-            final_score_text = self.large_font.render(f'score: {self.score}', True, self.white)
+            final_score_text = self.text_cache.render(self.large_font, f'score: {self.score}', self.white)
             final_score_text_box = final_score_text.get_rect()
             final_score_text_box.center = self.width / 2, self.height / 2 + 140
             self.screen.blit(final_score_text, final_score_text_box)
@@ -421,10 +564,7 @@ class Game:
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT or event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
-                if self.score > self.track.high_score and not self.cheated:
-                    self.track.set_high_score(self.score)
-                    self.track.set_high_score_accuracy(self.calculate_accuracy())
-                    self.track.set_high_score_layers(''.join((sorted(self.enabled_layers_keys.keys()))))
+                self.record_high_score()
                 self.score_screen = False
                 return
 
@@ -439,12 +579,28 @@ class Game:
             else:
                 break
 
-        self.close_game()
+        # the stream carries on into the next track
+        if not self.next_started:
+            self.close_game()
+
+    def start_game(self, delay_time=None):
+        if delay_time is None:
+            delay_time = self.audio_player.delay_time
+        self.audio_player.open_audio(self.track.audio_filepath, self.start_time, self.speed)
+        self.track_number = self.audio_player.track_number
+        if self.start_time:
+            for layer_object in self.layers.values():
+                layer_object.seek(self.start_time)
+        self.time = self.start_time - delay_time
+        self.simulation_tick = floor(self.time / Game.SIMULATION_STEP)
+        self.audio_player.play(delay_time)
+        self.display_loop()
 
-    def start_game(self):
-        self.audio_player.open_audio(self.track.audio_filepath)
-        self.time = -self.audio_player.delay_time + self.audio_player.fast_forward_time
-        self.audio_player.play()
+    def continue_game(self):
+        # the track is already playing, queued right after the previous game's track
+        self.track_number = self.audio_player.track_number
+        self.time = self.audio_player.get_time()
+        self.simulation_tick = floor(self.time / Game.SIMULATION_STEP)
         self.display_loop()
 
     def close_game(self):
@@ -0,0 +1,92 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from os import cpu_count, walk
+from os.path import join
+
+from metadata_cache import MetadataCache
+from track import Track
+
+AUDIO_EXTENSIONS = ('.flac', '.opus', '.mp3', '.m4a')
+
+
+def find_audio_files(directory):
+    for root, directories, filenames in walk(directory):
+        directories.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(AUDIO_EXTENSIONS):
+                yield join(root, filename)
+
+
+def open_metadata_cache():
+    # each worker process needs its own connection
+    Track.metadata_cache = MetadataCache()
+
+
+def analyze_track(audio_filepath):
+    # runs in a worker process, maps left by an interrupted import are reused
+    track = Track(audio_filepath)
+    track.generate_track_file()
+    return track
+
+
+class Importer:
+    def __init__(self, library, directory, num_workers=None):
+        self.library = library
+        known_filepaths = {track.audio_filepath for track in library.saved_tracks}
+        self.pending = [audio_filepath for audio_filepath in find_audio_files(directory)
+                        if audio_filepath not in known_filepaths]
+        self.pending.reverse()
+
+        self.num_total = len(self.pending)
+        self.num_failed = 0
+        self.imported_tracks = []
+        self.last_filepath = None
+        self.merged = False
+
+        self.num_workers = num_workers or cpu_count() or 1
+        # workers are spawned rather than forked, forking copies the audio, map job and sweep threads' locks mid use
+        self.executor = ProcessPoolExecutor(max_workers=self.num_workers, mp_context=get_context('spawn'),
+                                            initializer=open_metadata_cache) if self.pending else None
+        self.futures = {}  # future -> audio filepath
+
+    def count_done(self):
+        return len(self.imported_tracks) + self.num_failed
+
+    def is_done(self):
+        return not self.pending and not self.futures
+
+    def poll(self):
+        # keep the pool busy without queueing every file up front, so cancelling is immediate
+        while self.pending and len(self.futures) < self.num_workers * 2:
+            audio_filepath = self.pending.pop()
+            self.futures[self.executor.submit(analyze_track, audio_filepath)] = audio_filepath
+
+        if self.futures:
+            done, _ = wait(self.futures, timeout=0, return_when=FIRST_COMPLETED)
+            for future in done:
+                self.last_filepath = self.futures.pop(future)
+                try:
+                    self.imported_tracks.append(future.result())
+                except Exception as e:
+                    print(f'ERROR: Could not import {self.last_filepath}: {e}')
+                    self.num_failed += 1
+
+        if self.is_done():
+            self.finish()
+
+    def cancel(self):
+        # tracks still being analyzed are dropped, their maps are reused by the next import
+        self.pending.clear()
+        self.futures.clear()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        self.finish()
+
+    def finish(self):
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+        if not self.merged:
+            self.library.add_tracks(self.imported_tracks)
+            self.merged = True
@@ -0,0 +1,36 @@
+from collections import deque
+from time import perf_counter, sleep
+
+import pygame
+
+
+class InputQueue:
+    # pygame only delivers events on the main thread, so they are polled between and during frames and stamped with
+    # perf_counter as they arrive, letting hits be judged at the time they happened rather than the frame handling them
+    def __init__(self, poll_interval=.001):
+        self.poll_interval = poll_interval
+        self.events = deque()  # (perf_counter time, event)
+
+    def poll(self):
+        time = perf_counter()
+        for event in pygame.event.get():
+            self.events.append((time, event))
+
+    def wait(self, until):
+        # sleeps until the perf_counter time until, still polling for input
+        while 1:
+            self.poll()
+            remaining = until - perf_counter()
+            if remaining <= 0:
+                break
+            sleep(min(self.poll_interval, remaining))
+
+    def get(self):
+        self.poll()
+        events = self.events
+        self.events = deque()
+        return events
+
+    def put_back(self, events):
+        # events taken with get but not handled yet go back to the front of the queue
+        self.events.extendleft(reversed(events))
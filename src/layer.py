@@ -1,7 +1,17 @@
-from beat import Beat
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Beat states
+APPROACHING = 0
+IN_WINDOW = 1  # has been inside the perfect window
+HIT = 2
+MISSED = 3
 
 
 class Layer:
+
+    MAX_SHADOWS = 64
+
     def __init__(self, layer_id, key):
         self.layer_id = layer_id
         self.color = {
@@ -12,10 +22,17 @@ class Layer:
             'E': (128, 128, 255),
             'F': (255, 128, 255)
         }[layer_id]
-        self.beats = []
-        self.shadows = []
         self.key = key
 
+        self.beat_times = array('f')
+        self.beat_states = bytearray()
+        self.cursor = 0  # index of next unhit beat
+        self.window_cursor = 0  # index of the first beat not yet inside the perfect window
+
+        self.shadows = array('l', [0] * Layer.MAX_SHADOWS)  # ring buffer of missed beat indices
+        self.shadow_start = 0
+        self.shadow_count = 0
+
         self.line_thickness = 3
         self.key_label_text = None
         self.key_label_text_box = None
@@ -24,24 +41,69 @@ class Layer:
         self.line_thickness = num_pixels
 
     # Beats
+    def set_beats(self, beat_times):
+        self.beat_times = beat_times
+        self.beat_states = bytearray(len(beat_times))
+        self.cursor = 0
+        self.window_cursor = 0
+        self.shadow_start = 0
+        self.shadow_count = 0
+
+    def count_beats(self):
+        return len(self.beat_times)
+
     def count_remaining_beats(self):
-        return len(self.beats)
+        return len(self.beat_times) - self.cursor
+
+    def next_beat_time(self):
+        return self.beat_times[self.cursor]
+
+    def find_beats(self, start_time, end_time):
+        # remaining beats with start_time <= time <= end_time, as an index range
+        start_index = bisect_left(self.beat_times, start_time, self.cursor)
+        return start_index, bisect_right(self.beat_times, end_time, start_index)
 
-    def get_beat(self, index):
-        return self.beats[index]
+    def seek(self, time):
+        # beats from time on can be played again, earlier ones are skipped
+        self.cursor = self.window_cursor = bisect_left(self.beat_times, time)
+        self.beat_states[self.cursor:] = bytes(len(self.beat_states) - self.cursor)
+        self.shadow_start = 0
+        self.shadow_count = 0
 
-    def insert_beat(self, beat_time):
-        self.beats.insert(0, Beat(beat_time))
+    def enter_window(self, time):
+        # remaining beats up to time have been inside the perfect window
+        start_index = max(self.cursor, self.window_cursor)
+        end_index = bisect_right(self.beat_times, time, start_index)
+        self.beat_states[start_index:end_index] = bytes((IN_WINDOW,)) * (end_index - start_index)
+        self.window_cursor = max(self.window_cursor, end_index)
 
-    def remove_last_beat(self):
-        return self.beats.pop()
+    def hit_next_beat(self):
+        self.beat_states[self.cursor] = HIT
+        self.cursor += 1
+
+    def miss_next_beat(self):
+        self.beat_states[self.cursor] = MISSED
+        self.insert_shadow(self.cursor)
+        self.cursor += 1
 
     # Shadows
     def count_shadows(self):
-        return len(self.shadows)
+        return self.shadow_count
+
+    def insert_shadow(self, beat_index):
+        if self.shadow_count == Layer.MAX_SHADOWS:
+            self.remove_oldest_shadow()
+        self.shadows[(self.shadow_start + self.shadow_count) % Layer.MAX_SHADOWS] = beat_index
+        self.shadow_count += 1
+
+    def get_shadow_time(self, index):
+        return self.beat_times[self.shadows[(self.shadow_start + index) % Layer.MAX_SHADOWS]]
 
-    def insert_shadow(self, beat):
-        self.shadows.insert(0, beat)
+    def remove_shadows(self, time):
+        # shadows of beats before time are out of sight
+        while self.shadow_count > 0 and self.get_shadow_time(0) < time:
+            self.remove_oldest_shadow()
 
-    def remove_last_shadow(self):
-        return self.shadows.pop()
+    def remove_oldest_shadow(self):
+        self.shadow_start = (self.shadow_start + 1) % Layer.MAX_SHADOWS
+        self.shadow_count -= 1
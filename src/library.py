@@ -1,52 +1,284 @@
-from track import Track
+from array import array
+from bisect import bisect_left, insort
+from os import listdir, remove, stat
+from os.path import join
+from threading import Lock
+from time import time
+
+from search_index import SearchIndex
 
 
 class Library:
-    def __init__(self):
-        self.saved_tracks = []
+    # tracks are kept as parallel columns with a permutation of them for each sort order, the menu sees a view, the
+    # current order's permutation narrowed down by the difficulty filter, so changing order never sorts
 
-    def add_track(self, new_track):
-        sort_title = new_track.title.lower()
+    SORT_ORDERS = ('title', 'artist', 'difficulty', 'duration', 'high score')
+    ORDER_FIELDS = {  # track fields each sort order depends on
+        'title': {'title', 'artist', 'album'},
+        'artist': {'title', 'artist', 'album'},
+        'difficulty': {'title', 'difficulty'},
+        'duration': {'title', 'duration'},
+        'high score': {'title', 'high_score'}
+    }
+
+    def __init__(self, store=None):
+        self.store = store
+        self.saved_tracks = []  # in no particular order, tracks are looked up by their index in the view
+        self.positions = {}  # audio filepath -> index in saved_tracks
+
+        # Columns, parallel to saved_tracks
+        self.titles = []  # lowercase
+        self.artists = []  # lowercase
+        self.albums = []  # lowercase
+        self.durations = array('d')
+        self.difficulties = array('d')  # -1 until the track's map is generated
+        self.high_scores = array('q')
+
+        self.sort_keys = {
+            'title': lambda i: (self.titles[i], self.artists[i], self.albums[i]),
+            'artist': lambda i: (self.artists[i], self.albums[i], self.titles[i]),
+            'difficulty': lambda i: (self.difficulties[i], self.titles[i]),
+            'duration': lambda i: (self.durations[i], self.titles[i]),
+            'high score': lambda i: (-self.high_scores[i], self.titles[i])
+        }
+        self.orders = {order: array('l') for order in Library.SORT_ORDERS}  # order -> saved_tracks indices in order
+        self.sort_order = 'title'
+        self.difficulty_range = None  # (minimum, maximum), maximum excluded
+        self.view = self.orders[self.sort_order]
+
+        self.search_index = None  # built in the background after loading, see build_search_index
+        self.search_changes = []  # (track, removed) made while the search index was being built
+        self.search_lock = Lock()
+
+        if store:
+            self.saved_tracks = list(store.load_tracks())
+            self.build_columns()
+            self.build_orders()
+
+    # Columns
+    def build_columns(self):
+        tracks = self.saved_tracks
+        self.positions = {track.audio_filepath: position for position, track in enumerate(tracks)}
+        self.titles = [track.title.lower() for track in tracks]
+        self.artists = [track.artist.lower() for track in tracks]
+        self.albums = [track.album.lower() for track in tracks]
+        self.durations = array('d', [track.duration for track in tracks])
+        self.difficulties = array('d', [-1 if track.difficulty is None else track.difficulty for track in tracks])
+        self.high_scores = array('q', [track.high_score for track in tracks])
 
-        start_index = 0
-        end_index = len(self.saved_tracks)
+    def append_columns(self, track):
+        self.positions[track.audio_filepath] = len(self.saved_tracks)
+        self.saved_tracks.append(track)
+        self.titles.append('')
+        self.artists.append('')
+        self.albums.append('')
+        self.durations.append(0)
+        self.difficulties.append(0)
+        self.high_scores.append(0)
+        self.set_columns(len(self.saved_tracks) - 1)
 
-        if end_index == 0:
-            self.saved_tracks.append(new_track)
-            new_track.generate_track_file()
-            return 0
+    def set_columns(self, position):
+        track = self.saved_tracks[position]
+        self.titles[position] = track.title.lower()
+        self.artists[position] = track.artist.lower()
+        self.albums[position] = track.album.lower()
+        self.durations[position] = track.duration
+        self.difficulties[position] = -1 if track.difficulty is None else track.difficulty
+        self.high_scores[position] = track.high_score
+
+    def build_orders(self):
+        # stable sorts by one column at a time starting from title order give the orders of the sort keys, without
+        # comparing key tuples. arrays are refilled in place, the view may be one of them
+        title_order = sorted(sorted(sorted(range(len(self.saved_tracks)), key=self.albums.__getitem__),
+                                    key=self.artists.__getitem__), key=self.titles.__getitem__)
+        orders = {
+            'title': title_order,
+            'artist': sorted(sorted(title_order, key=self.albums.__getitem__), key=self.artists.__getitem__),
+            'difficulty': sorted(title_order, key=self.difficulties.__getitem__),
+            'duration': sorted(title_order, key=self.durations.__getitem__),
+            'high score': sorted(title_order, key=self.high_scores.__getitem__, reverse=True)
+        }
+        for order, indices in self.orders.items():
+            indices[:] = array('l', orders[order])
+        self.update_view()
+
+    def find_in_order(self, order, position):
+        # the columns must still hold the values position was sorted by
+        indices = self.orders[order]
+        key = self.sort_keys[order]
+        index = bisect_left(indices, key(position), key=key)
+        while indices[index] != position:
+            index += 1
+        return index
+
+    # Views
+    def update_view(self):
+        indices = self.orders[self.sort_order]
+        if self.difficulty_range is None:
+            self.view = indices
         else:
-            while 1:
-                middle_index = (start_index + end_index) // 2
-
-                if start_index == end_index:
-                    self.saved_tracks.insert(middle_index, new_track)
-                    new_track.generate_track_file()
-                    return middle_index
-                elif sort_title == self.saved_tracks[middle_index].title.lower():
-                    if self.saved_tracks[middle_index] == new_track:
-                        return middle_index
-                    else:
-                        self.saved_tracks.insert(middle_index, new_track)
-                        new_track.generate_track_file()
-                        return middle_index
-                elif sort_title > self.saved_tracks[middle_index].title.lower():
-                    start_index = middle_index + 1
-                elif sort_title < self.saved_tracks[middle_index].title.lower():
-                    end_index = middle_index
+            minimum, maximum = self.difficulty_range
+            difficulties = self.difficulties
+            self.view = array('l', [i for i in indices if minimum <= difficulties[i] < maximum])
+
+    def set_sort_order(self, order):
+        self.sort_order = order
+        self.update_view()
+
+    def set_difficulty_range(self, difficulty_range):
+        self.difficulty_range = difficulty_range
+        self.update_view()
+
+    def count_tracks(self):
+        return len(self.view)
+
+    def get_track(self, index):
+        return self.saved_tracks[self.view[index]]
+
+    def get_track_range(self, start_index, end_index):
+        return [self.saved_tracks[i] for i in self.view[start_index:end_index]]
+
+    def contains(self, track):
+        return track.audio_filepath in self.positions
+
+    def index_of(self, track):
+        # None if the track is filtered out
+        position = self.positions.get(track.audio_filepath)
+        if position is None:
+            return None
+        if self.difficulty_range is None:
+            return self.find_in_order(self.sort_order, position)
+        try:
+            return self.view.index(position)
+        except ValueError:
+            return None
+
+    # Changes
+    def add_track(self, new_track):
+        if not self.contains(new_track):
+            self.append_columns(new_track)
+            position = len(self.saved_tracks) - 1
+            for order, indices in self.orders.items():
+                insort(indices, position, key=self.sort_keys[order])
+            if self.difficulty_range is not None:
+                self.update_view()
+            self.save_track(new_track)
+        return self.index_of(new_track)
+
+    def add_tracks(self, new_tracks):
+        # merge already generated tracks in one batch
+        new_tracks = [track for track in new_tracks if not self.contains(track)]
+        for track in new_tracks:
+            self.append_columns(track)
+        self.build_orders()
+        if self.store:
+            self.store.save_tracks(new_tracks)
+        for track in new_tracks:
+            self.update_search_index(track)
 
     def remove_track(self, index):
-        return self.saved_tracks.pop(index)
+        # the last track takes the removed track's place in saved_tracks and the columns
+        position = self.view[index]
+        last_position = len(self.saved_tracks) - 1
+        track = self.saved_tracks[position]
+        for order, indices in self.orders.items():
+            del indices[self.find_in_order(order, position)]
+            if position != last_position:
+                indices[self.find_in_order(order, last_position)] = position
+
+        del self.positions[track.audio_filepath]
+        if position != last_position:
+            last_track = self.saved_tracks[last_position]
+            self.saved_tracks[position] = last_track
+            self.positions[last_track.audio_filepath] = position
+            for column in (self.titles, self.artists, self.albums, self.durations, self.difficulties, self.high_scores):
+                column[position] = column[last_position]
+        for column in (self.saved_tracks, self.titles, self.artists, self.albums, self.durations, self.difficulties, self.high_scores):
+            column.pop()
+        if self.difficulty_range is not None:
+            self.update_view()
+
+        if self.store:
+            self.store.delete_track(track)
+        self.update_search_index(track, removed=True)
+        return track
+
+    def save_track(self, track):
+        if self.store:
+            self.store.save_track(track)
+        self.update_search_index(track)
+
+    def update_track(self, track, *fields):
+        if self.store:
+            self.store.update_track(track, *fields)
+        if {'title', 'artist', 'album'} & set(fields):
+            self.update_search_index(track)
+
+        # only orders depending on a changed field move the track
+        position = self.positions.get(track.audio_filepath)
+        changed_orders = [order for order, order_fields in Library.ORDER_FIELDS.items() if order_fields & set(fields)]
+        if position is None or not changed_orders:
+            return
+        for order in changed_orders:
+            del self.orders[order][self.find_in_order(order, position)]
+        self.set_columns(position)
+        for order in changed_orders:
+            insort(self.orders[order], position, key=self.sort_keys[order])
+        if self.difficulty_range is not None:
+            self.update_view()
+
+    def check_files(self):
+        # run in the background after loading, so startup doesn't wait on every track's files
+        for track in list(self.saved_tracks):
+            track.check_files()
+
+    def uses_map(self, map_filepath):
+        return any(track.map_filepath == map_filepath for track in self.saved_tracks)
+
+    def remove_orphaned_maps(self, directory='library/maps', min_age=24 * 60 * 60):
+        # maps no track uses, left by deleted tracks or an earlier ctaff, and partial files left by interrupted map
+        # generation. generating a map, or finding it already generated, touches it, so files modified within min_age
+        # seconds may belong to tracks still being imported
+        max_mtime = time() - min_age
+        used_filepaths = {track.map_filepath for track in list(self.saved_tracks)}
+        for filename in listdir(directory):
+            filepath = join(directory, filename)
+            if filename.endswith('.map') and filepath not in used_filepaths or filename.endswith('.part'):
+                try:
+                    if stat(filepath).st_mtime < max_mtime:
+                        remove(filepath)
+                except OSError:
+                    pass
+
+    def close(self):
+        if self.store:
+            self.store.close()
+
+    # Search
+    def build_search_index(self):
+        # takes seconds for a large library, so it runs in the background. changes made meanwhile are replayed on the
+        # finished index before searches see it
+        search_index = SearchIndex(list(self.saved_tracks))
+        with self.search_lock:
+            for track, removed in self.search_changes:
+                if removed:
+                    search_index.remove_track(track)
+                else:
+                    search_index.add_track(track)
+            self.search_changes = []
+            self.search_index = search_index
 
-    def get_tracks(self, center_index):
-        tracks = []
-        for i in range(center_index - 3, center_index + 4):
-            if -1 < i < len(self.saved_tracks):
-                tracks.append(self.saved_tracks[i])
+    def update_search_index(self, track, removed=False):
+        with self.search_lock:
+            if self.search_index is None:
+                self.search_changes.append((track, removed))
+            elif removed:
+                self.search_index.remove_track(track)
             else:
-                tracks.append('')
-        return tracks
+                self.search_index.add_track(track)
 
     def search(self, query):
-        matches = []
-        return matches
+        # no results until the index is built
+        if self.search_index is None:
+            return []
+        return self.search_index.search(query)
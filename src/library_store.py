@@ -0,0 +1,83 @@
+from json import dumps
+from os import replace
+from pickle import load
+import sqlite3
+
+from track import Track
+
+
+class LibraryStore:
+
+    COLUMNS = ('audio_filepath', 'map_filepath', 'title', 'artist', 'album', 'duration', 'num_beats', 'difficulty',
+               'high_score', 'high_score_accuracy', 'high_score_layers', 'practice_high_scores')
+    JSON_COLUMNS = ('num_beats', 'practice_high_scores')
+
+    def __init__(self, filepath='library/library.db'):
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS tracks ('
+                                    'audio_filepath TEXT PRIMARY KEY, '
+                                    'map_filepath TEXT, '
+                                    'title TEXT, '
+                                    'artist TEXT, '
+                                    'album TEXT, '
+                                    'duration REAL, '
+                                    'num_beats TEXT, '
+                                    'difficulty REAL, '
+                                    'high_score INTEGER, '
+                                    'high_score_accuracy REAL, '
+                                    'high_score_layers TEXT, '
+                                    'practice_high_scores TEXT)')
+            # databases from before practice speeds
+            if 'practice_high_scores' not in {row[1] for row in self.connection.execute('PRAGMA table_info(tracks)')}:
+                self.connection.execute('ALTER TABLE tracks ADD COLUMN practice_high_scores TEXT')
+
+    @staticmethod
+    def to_column(track, column):
+        value = getattr(track, column)
+        return dumps(value) if column in LibraryStore.JSON_COLUMNS else value
+
+    def load_tracks(self):
+        # builds tracks straight from their rows, without touching audio or map files. json columns are left for the
+        # track to decode when they're first used, most aren't until the track is selected or played
+        for row in self.connection.execute(f'SELECT {", ".join(LibraryStore.COLUMNS)} FROM tracks'):
+            fields = dict(zip(LibraryStore.COLUMNS, row))
+            encoded_fields = {column: fields.pop(column) for column in LibraryStore.JSON_COLUMNS}
+            track = Track(fields.pop('audio_filepath'), fields.pop('map_filepath'), read_tags=False, encoded_fields=encoded_fields)
+            for column, value in fields.items():
+                setattr(track, column, value)
+            yield track
+
+    def save_track(self, track):
+        self.save_tracks((track,))
+
+    def save_tracks(self, tracks):
+        with self.connection:
+            self.connection.executemany(f'INSERT OR REPLACE INTO tracks ({", ".join(LibraryStore.COLUMNS)}) '
+                                        f'VALUES ({", ".join("?" * len(LibraryStore.COLUMNS))})',
+                                        ([LibraryStore.to_column(track, column) for column in LibraryStore.COLUMNS]
+                                         for track in tracks))
+
+    def update_track(self, track, *columns):
+        with self.connection:
+            self.connection.execute(f'UPDATE tracks SET {", ".join(f"{column} = ?" for column in columns)} '
+                                    f'WHERE audio_filepath = ?',
+                                    [LibraryStore.to_column(track, column) for column in columns] + [track.audio_filepath])
+
+    def delete_track(self, track):
+        with self.connection:
+            self.connection.execute('DELETE FROM tracks WHERE audio_filepath = ?', (track.audio_filepath,))
+
+    def migrate_pickle(self, filepath):
+        # one time import of a pickled Library, the pickle is kept as a backup
+        with open(filepath, 'rb') as f:
+            library = load(f)
+        for track in library.saved_tracks:
+            track.__dict__.setdefault('practice_high_scores', {})
+        self.save_tracks(library.saved_tracks)
+        replace(filepath, f'{filepath}.bak')
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,60 @@
+from queue import Empty, Queue
+from threading import Thread
+
+from track import Track
+
+
+class MapJobQueue:
+    def __init__(self):
+        self.jobs = Queue()
+        self.completed = Queue()  # finished tracks, handed back to the UI thread by pop_completed
+        self.cancelled = set()  # audio filepaths
+        self.current_track = None
+
+        Thread(target=self.work_thread, daemon=True).start()
+
+    def submit(self, track):
+        self.cancelled.discard(track.audio_filepath)
+        track.set_status(Track.GENERATING)
+        self.jobs.put(track)
+
+    def cancel(self, track):
+        if track.status == Track.GENERATING:
+            self.cancelled.add(track.audio_filepath)
+            track.cancel_generation()
+
+    def cancel_all(self):
+        while 1:
+            try:
+                self.cancel(self.jobs.get_nowait())
+            except Empty:
+                break
+        if self.current_track:
+            self.cancel(self.current_track)
+
+    def pop_completed(self):
+        tracks = []
+        while 1:
+            try:
+                tracks.append(self.completed.get_nowait())
+            except Empty:
+                return tracks
+
+    def work_thread(self):
+        while 1:
+            track = self.jobs.get()
+            if track.audio_filepath in self.cancelled:
+                continue
+
+            self.current_track = track
+            try:
+                track.generate_track_file()
+                track.set_status(Track.READY)
+            except Exception as e:
+                if track.audio_filepath not in self.cancelled:
+                    print(f'ERROR: Could not generate map for {track.audio_filepath}: {e}')
+                track.set_status(Track.FAILED)
+            self.current_track = None
+
+            if track.audio_filepath not in self.cancelled:
+                self.completed.put(track)
@@ -1,15 +1,23 @@
-from os.path import isfile
-from pickle import dump, load
+from concurrent.futures import ThreadPoolExecutor
+from os.path import isdir, isfile
+from threading import Thread
 
 import pygame
-from pygame.font import Font
 from pygame.time import Clock
 from pyperclip import paste
 
 from audio_player import AudioPlayer
+from beatmap import read_map
 from game import Game
+from importer import Importer
 from library import Library
+from library_store import LibraryStore
+from map_jobs import MapJobQueue
+from metadata_cache import MetadataCache
+from pcm_cache import PCMCache
+from text_cache import TextCache, load_font
 from track import Track
+from track_list import TrackList
 from util import ALL_LAYERS, seconds_to_readable_time
 
 
@@ -37,10 +45,11 @@ class Menu:
     DISABLED_COLOR = A_COLOR
 
     DIFFICULTY_COLORS = (C_COLOR, C_COLOR, C_COLOR, B_COLOR, B_COLOR, A_COLOR, D_COLOR, E_COLOR, F_COLOR)
+    DIFFICULTY_RANGES = (None, (0, 2), (2, 4), (4, 6), (6, 8), (8, float('inf')))  # track select filters, cycled with f
 
     def __init__(self):
-        pygame.mixer.pre_init(frequency=44100, size=-16, channels=2)
         pygame.init()
+        pygame.mixer.quit()  # hit sounds are mixed into the music stream instead
 
         self.clock = Clock()
 
@@ -51,10 +60,18 @@ class Menu:
         pygame.display.set_icon(pygame.image.load('img/icon.png'))
         pygame.display.set_caption('RIZUMU')
 
+        Track.metadata_cache = MetadataCache()
+        library_store = LibraryStore()
         if isfile('library/saved.library'):
-            self.library = load(open('library/saved.library', 'rb'))
-        else:
-            self.library = Library()
+            library_store.migrate_pickle('library/saved.library')
+        self.library = Library(library_store)
+        Thread(target=self.sweep_library, daemon=True).start()
+
+        # Map generation runs in the background, tracks interrupted last session are resumed
+        self.map_jobs = MapJobQueue()
+        for track in self.library.saved_tracks:
+            if track.difficulty is None:
+                self.map_jobs.submit(track)
 
         pygame.mouse.set_visible(False)
 
@@ -68,17 +85,18 @@ class Menu:
                              self.draw_search]
 
         self.delay_time = 2  # Pre-track delay time
+        self.marathon_length = 5  # tracks
+        self.prefetcher = ThreadPoolExecutor(max_workers=1)
 
         # Audio player
-        self.audio_player = AudioPlayer(self.delay_time)
+        self.pcm_cache = PCMCache()
+        self.audio_player = AudioPlayer(self.delay_time, pcm_cache=self.pcm_cache)
         err_code = self.audio_player.set_device()  # Use system default
         if err_code:
             print('FATAL ERROR: Closing.')
             pygame.display.quit()
             return
 
-        self.latency = self.audio_player.device.get_output_latency()
-
         # In-game options
         self.layers_keys = {'A': [True, pygame.K_s], 
                             'B': [True, pygame.K_d], 
@@ -87,21 +105,24 @@ class Menu:
                             'E': [True, pygame.K_k], 
                             'F': [True, pygame.K_l]}
         self.prune_unused_layers = False
+        self.max_frame_rate = 0  # caps how often the playing screen is drawn, 0 for no cap
 
         # Difficulty
         self.preview_length = .5
         self.lenience = 0.06  # seconds +/- per beat
+        self.speed = 1.0  # practice speed, 0.5 to 1.5
 
         # Fonts
-        self.large_font = Font('font/unifont.ttf', 36)
-        self.generic_font = Font('font/unifont.ttf', 26)
-        self.small_font = Font('font/unifont.ttf', 16)
+        self.large_font = load_font(36)
+        self.generic_font = load_font(26)
+        self.small_font = load_font(16)
+        self.text_cache = TextCache()
 
         # Sound Effects
         self.play_hit_sound = False
-        self.bass_hit_sound_data = pygame.mixer.Sound(open('audio/bass.wav', 'rb').read())
-        self.high_hit_sound_data = pygame.mixer.Sound(open('audio/high.wav', 'rb').read())
-        pygame.mixer.set_num_channels(2)
+        self.audio_player.hit_sounds.load_sound('bass', 'audio/bass.wav')
+        self.audio_player.hit_sounds.load_sound('high', 'audio/high.wav')
+        self.hit_sounds = {'A': 'bass', 'B': 'bass', 'C': 'high', 'D': 'high', 'E': 'high', 'F': 'high'}
 
         # GUI variables
         self.current_screen = Menu.TITLE
@@ -111,15 +132,15 @@ class Menu:
         '''
         Main menu screen objects
         '''
-        self.main_title = self.large_font.render('RIZUMU', True, Menu.WHITE)
+        self.main_title = self.text_cache.render(self.large_font, 'RIZUMU', Menu.WHITE)
         self.main_title_box = self.main_title.get_rect()
         self.main_title_box.center = self.width / 2, 200
 
-        self.main_play = self.large_font.render('Play', True, Menu.SELECTED_COLOR)
+        self.main_play = self.text_cache.render(self.large_font, 'Play', Menu.SELECTED_COLOR)
         self.main_play_box = self.main_play.get_rect()
         self.main_play_box.center = self.width / 2, 400
 
-        self.main_settings = self.large_font.render(f'Settings', True, Menu.WHITE)
+        self.main_settings = self.text_cache.render(self.large_font, f'Settings', Menu.WHITE)
         self.main_settings_box = self.main_settings.get_rect()
         self.main_settings_box.center = self.width / 2, 500
 
@@ -130,97 +151,84 @@ class Menu:
         '''
         Track select screen objects
         '''
-        self.selected_tracks = self.library.get_tracks(self.track_selection_index)
-        self.select_track_0 = None
-        self.select_track_1 = None
-        self.select_track_2 = None
-        self.select_track_3 = None
-        self.select_track_4 = None
-        self.select_track_5 = None
-        self.select_track_6 = None
-
-        self.render_selected_tracks()
-
-        self.select_track_title = None
-        self.select_track_artist = None
-        self.select_track_album = None
-        self.select_track_high_score = None
-        self.select_track_high_score_accuracy = None
-        self.select_track_high_score_layers = None
-        self.select_track_duration = None
-        self.select_track_difficulty = None
-        self.select_track_num_beats_A = None
-        self.select_track_num_beats_B = None
-        self.select_track_num_beats_C = None
-        self.select_track_num_beats_D = None
-        self.select_track_num_beats_E = None
-        self.select_track_num_beats_F = None
-
-        self.render_selected_track_data()
-
-        self.select_edit = self.generic_font.render('e: Edit', True, Menu.WHITE)
-        self.select_new = self.generic_font.render('n: New', True, Menu.WHITE)
-        self.select_back = self.generic_font.render('⌫ : Back', True, Menu.WHITE)
-        self.select_play = self.generic_font.render('⏎ : Play', True, Menu.WHITE)
+        self.selected_track = self.library.get_track(self.track_selection_index) if self.library.count_tracks() else None
+        self.track_list = TrackList(self.library, self.generic_font, Menu.get_track_row, self.get_track_details, (self.width, 320))
+
+        self.select_edit = self.text_cache.render(self.generic_font, 'e: Edit', Menu.WHITE)
+        self.select_new = self.text_cache.render(self.generic_font, 'n: New', Menu.WHITE)
+        self.select_search = self.text_cache.render(self.generic_font, '/: Search', Menu.WHITE)
+        self.select_marathon = self.text_cache.render(self.generic_font, 'm: Marathon', Menu.WHITE)
+        self.select_back = self.text_cache.render(self.generic_font, '⌫ : Back', Menu.WHITE)
+        self.select_sort_order = None
+        self.select_difficulty_range = None
+        self.render_library_view_labels()
+        self.select_play = self.text_cache.render(self.generic_font, '⏎ : Play', Menu.WHITE)
 
         '''
         Track setup screen objects
         '''
-        self.setup_toggle = self.generic_font.render('⏎ : Select/Toggle', True, Menu.WHITE)
+        self.setup_toggle = self.text_cache.render(self.generic_font, '⏎ : Select/Toggle', Menu.WHITE)
         self.setup_back = self.select_back
 
         '''
         New track screen objects
         '''
-        self.new_track_edit = self.generic_font.render('⏎ : Paste from clipboard', True, Menu.WHITE)
-        self.new_track_save = self.generic_font.render('s: Save', True, Menu.WHITE)
-        self.new_track_cancel = self.generic_font.render('⌫ : Cancel', True, Menu.WHITE)
+        self.new_track_edit = self.text_cache.render(self.generic_font, '⏎ : Paste from clipboard', Menu.WHITE)
+        self.new_track_save = self.text_cache.render(self.generic_font, 's: Save', Menu.WHITE)
+        self.new_track_cancel = self.text_cache.render(self.generic_font, '⌫ : Cancel', Menu.WHITE)
 
         '''
         Edit track screen objects
         '''
-        self.edit_track_delete = self.generic_font.render('d: Delete', True, Menu.WHITE)
+        self.edit_track_delete = self.text_cache.render(self.generic_font, 'd: Delete', Menu.WHITE)
 
         '''
         Search track screen objects
         '''
+        self.search_select = self.text_cache.render(self.generic_font, '⏎ : Select', Menu.WHITE)
+        self.search_back = self.text_cache.render(self.generic_font, 'esc: Back', Menu.WHITE)
 
         # Start drawing
         self.display_loop()
 
-    def render_selected_tracks(self):
-        def get_color(track):
-            if not track:
-                return Menu.WHITE
-            else:
-                return Menu.DIFFICULTY_COLORS[min(8, int(track.difficulty))]
-
-        self.select_track_0 = self.generic_font.render(f'{self.selected_tracks[0]}', True, get_color(self.selected_tracks[0]))
-        self.select_track_1 = self.generic_font.render(f'{self.selected_tracks[1]}', True, get_color(self.selected_tracks[1]))
-        self.select_track_2 = self.generic_font.render(f'{self.selected_tracks[2]}', True, get_color(self.selected_tracks[2]))
-        self.select_track_3 = self.generic_font.render(f'{self.selected_tracks[3]}', True, get_color(self.selected_tracks[3]))
-        self.select_track_4 = self.generic_font.render(f'{self.selected_tracks[4]}', True, get_color(self.selected_tracks[4]))
-        self.select_track_5 = self.generic_font.render(f'{self.selected_tracks[5]}', True, get_color(self.selected_tracks[5]))
-        self.select_track_6 = self.generic_font.render(f'{self.selected_tracks[6]}', True, get_color(self.selected_tracks[6]))
-
-    def render_selected_track_data(self):
-        if self.selected_tracks[3]:
-            color = Menu.DIFFICULTY_COLORS[min(8, int(self.selected_tracks[3].difficulty))]
-            self.select_track_title = self.large_font.render(f'{self.selected_tracks[3].title}', True, color)
-            self.select_track_artist = self.generic_font.render(f'{self.selected_tracks[3].artist}', True, Menu.WHITE)
-            self.select_track_album = self.generic_font.render(f'{self.selected_tracks[3].album}', True, Menu.WHITE)
-            self.select_track_high_score = self.generic_font.render(f'High Score: {self.selected_tracks[3].high_score}', True, Menu.WHITE)
-            self.select_track_high_score_accuracy = self.generic_font.render(f'{self.selected_tracks[3].high_score_accuracy:.3f}%', True, Menu.WHITE)
-            self.select_track_high_score_layers = self.generic_font.render(f'{self.selected_tracks[3].high_score_layers}', True, Menu.WHITE)
-            self.select_track_duration = self.generic_font.render(f'{seconds_to_readable_time(self.selected_tracks[3].duration)}', True, Menu.WHITE)
-            self.select_track_difficulty = self.generic_font.render(f'Difficulty: {self.selected_tracks[3].difficulty}', True, color)
-
-            self.select_track_num_beats_A = self.generic_font.render(f'{self.selected_tracks[3].num_beats["A"]}', True, Menu.A_COLOR)
-            self.select_track_num_beats_B = self.generic_font.render(f'{self.selected_tracks[3].num_beats["B"]}', True, Menu.B_COLOR)
-            self.select_track_num_beats_C = self.generic_font.render(f'{self.selected_tracks[3].num_beats["C"]}', True, Menu.C_COLOR)
-            self.select_track_num_beats_D = self.generic_font.render(f'{self.selected_tracks[3].num_beats["D"]}', True, Menu.D_COLOR)
-            self.select_track_num_beats_E = self.generic_font.render(f'{self.selected_tracks[3].num_beats["E"]}', True, Menu.E_COLOR)
-            self.select_track_num_beats_F = self.generic_font.render(f'{self.selected_tracks[3].num_beats["F"]}', True, Menu.F_COLOR)
+    @staticmethod
+    def get_difficulty_color(track):
+        if not track:
+            return Menu.WHITE
+        elif track.difficulty is None:
+            return Menu.GRAY
+        else:
+            return Menu.DIFFICULTY_COLORS[min(8, int(track.difficulty))]
+
+    @staticmethod
+    def get_track_label(track):
+        if track and track.missing:
+            return f'{track} (missing)'
+        if track and track.status != Track.READY:
+            return f'{track} ({track.status})'
+        return f'{track}'
+
+    @staticmethod
+    def get_track_row(track):
+        return Menu.get_track_label(track), Menu.get_difficulty_color(track)
+
+    def get_track_details(self, track):
+        # (font, text, color, position) of each label in the details panel under the list
+        color = Menu.get_difficulty_color(track)
+        return [(self.large_font, f'{track.title}', color, (15, 15)),
+                (self.generic_font, f'{track.artist}', Menu.WHITE, (15, 90)),
+                (self.generic_font, f'{track.album}', Menu.WHITE, (15, 140)),
+                (self.generic_font, f'High Score: {track.high_score}', Menu.WHITE, (15, 190)),
+                (self.generic_font, f'{track.high_score_accuracy:.3f}%', Menu.WHITE, (self.width * .3, 190)),
+                (self.generic_font, f'{track.high_score_layers}', Menu.WHITE, (self.width * .45, 190)),
+                (self.generic_font, f'Difficulty: {track.difficulty if track.status == Track.READY else track.status}', color, (15, 240)),
+                (self.generic_font, f'{track.num_beats["A"]}', Menu.A_COLOR, (15, 290)),
+                (self.generic_font, f'{track.num_beats["B"]}', Menu.B_COLOR, (90, 290)),
+                (self.generic_font, f'{track.num_beats["C"]}', Menu.C_COLOR, (165, 290)),
+                (self.generic_font, f'{track.num_beats["D"]}', Menu.D_COLOR, (240, 290)),
+                (self.generic_font, f'{track.num_beats["E"]}', Menu.E_COLOR, (315, 290)),
+                (self.generic_font, f'{track.num_beats["F"]}', Menu.F_COLOR, (390, 290)),
+                (self.generic_font, f'{seconds_to_readable_time(track.duration)}', Menu.WHITE, (500, 290))]
 
     def draw_menu(self):
         label_selection_index = 0
@@ -231,12 +239,12 @@ class Menu:
                     return
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_UP:
-                        self.main_play = self.large_font.render('Play', True, Menu.SELECTED_COLOR)
-                        self.main_settings = self.large_font.render(f'Settings', True, Menu.WHITE)
+                        self.main_play = self.text_cache.render(self.large_font, 'Play', Menu.SELECTED_COLOR)
+                        self.main_settings = self.text_cache.render(self.large_font, f'Settings', Menu.WHITE)
                         label_selection_index = 0
                     elif event.key == pygame.K_DOWN:
-                        self.main_play = self.large_font.render('Play', True, Menu.WHITE)
-                        self.main_settings = self.large_font.render(f'Settings', True, Menu.SELECTED_COLOR)
+                        self.main_play = self.text_cache.render(self.large_font, 'Play', Menu.WHITE)
+                        self.main_settings = self.text_cache.render(self.large_font, f'Settings', Menu.SELECTED_COLOR)
                         label_selection_index = 1
                     elif event.key == pygame.K_RETURN:
                         if label_selection_index == 0:
@@ -261,24 +269,56 @@ class Menu:
     def draw_settings(self):
         pass
 
+    def render_library_view_labels(self):
+        self.select_sort_order = self.text_cache.render(self.generic_font, f'o: Sort by {self.library.sort_order}', Menu.WHITE)
+        difficulty_range = self.library.difficulty_range
+        if difficulty_range is None:
+            difficulty_label = 'all'
+        elif difficulty_range[1] == float('inf'):
+            difficulty_label = f'{difficulty_range[0]}+'
+        else:
+            difficulty_label = f'{difficulty_range[0]}-{difficulty_range[1]}'
+        self.select_difficulty_range = self.text_cache.render(self.generic_font, f'f: Difficulty {difficulty_label}', Menu.WHITE)
+
+    def update_selection(self, track=None):
+        # the selection follows track when the library's view changes under it
+        if track:
+            index = self.library.index_of(track)
+            if index is not None:
+                self.track_selection_index = index
+        self.track_selection_index = max(0, min(self.track_selection_index, self.library.count_tracks() - 1))
+        self.selected_track = self.library.get_track(self.track_selection_index) if self.library.count_tracks() else None
+        self.track_list.select(self.track_selection_index)
+
+    def sweep_library(self):
+        self.library.build_search_index()
+        self.library.check_files()
+        self.library.remove_orphaned_maps()
+
+    def update_generated_tracks(self):
+        completed_tracks = self.map_jobs.pop_completed()
+        for track in completed_tracks:
+            self.library.update_track(track, 'map_filepath', 'num_beats', 'difficulty')
+        if completed_tracks:
+            self.update_selection(self.selected_track)
+
     def draw_track_select(self):
         pygame.key.set_repeat(250, 20)
         while 1:
+            self.update_generated_tracks()
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.current_screen = Menu.EXIT
                     return
                 elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_UP:
-                        self.track_selection_index = max(self.track_selection_index - 1, 0)
-                        self.selected_tracks = self.library.get_tracks(self.track_selection_index)
-                        self.render_selected_tracks()
-                        self.render_selected_track_data()
-                    elif event.key == pygame.K_DOWN:
-                        self.track_selection_index = min(self.track_selection_index + 1, len(self.library.saved_tracks) - 1)
-                        self.selected_tracks = self.library.get_tracks(self.track_selection_index)
-                        self.render_selected_tracks()
-                        self.render_selected_track_data()
+                    if event.key in (pygame.K_UP, pygame.K_DOWN, pygame.K_PAGEUP, pygame.K_PAGEDOWN, pygame.K_HOME, pygame.K_END):
+                        self.track_selection_index = {pygame.K_UP: self.track_selection_index - 1,
+                                                      pygame.K_DOWN: self.track_selection_index + 1,
+                                                      pygame.K_PAGEUP: self.track_selection_index - TrackList.NUM_ROWS,
+                                                      pygame.K_PAGEDOWN: self.track_selection_index + TrackList.NUM_ROWS,
+                                                      pygame.K_HOME: 0,
+                                                      pygame.K_END: self.library.count_tracks() - 1}[event.key]
+                        self.update_selection()
                     else:
                         if event.key == pygame.K_RETURN:
                             self.current_screen = Menu.TRACK_SETUP
@@ -292,44 +332,40 @@ class Menu:
                         elif event.key == pygame.K_n:
                             self.current_screen = Menu.NEW_TRACK
                             return
+                        elif event.key == pygame.K_SLASH:
+                            self.current_screen = Menu.SEARCH
+                            return
+                        elif event.key == pygame.K_m:
+                            pygame.key.set_repeat()
+                            self.play_marathon()
+                            pygame.key.set_repeat(250, 20)
+                        elif event.key == pygame.K_o:
+                            sort_orders = Library.SORT_ORDERS
+                            self.library.set_sort_order(sort_orders[(sort_orders.index(self.library.sort_order) + 1) % len(sort_orders)])
+                            self.render_library_view_labels()
+                            self.update_selection(self.selected_track)
+                        elif event.key == pygame.K_f:
+                            difficulty_ranges = Menu.DIFFICULTY_RANGES
+                            self.library.set_difficulty_range(difficulty_ranges[(difficulty_ranges.index(self.library.difficulty_range) + 1) % len(difficulty_ranges)])
+                            self.render_library_view_labels()
+                            self.update_selection(self.selected_track)
 
             self.screen.fill((0, 0, 0))
 
             pygame.draw.rect(self.screen, Menu.GRAY, (15, 220, self.width - 30, 60), 1)
             pygame.draw.line(self.screen, Menu.GRAY, (0, 500), (self.width, 500))
 
-            self.screen.blit(self.select_track_0, (15, 30))
-            self.screen.blit(self.select_track_1, (30, 100))
-            self.screen.blit(self.select_track_2, (45, 170))
-            select_track_3_text_box = self.select_track_3.get_rect()
-            select_track_3_text_box.center = 0, 250
-            self.screen.blit(self.select_track_3, (60, select_track_3_text_box[1]))
-            self.screen.blit(self.select_track_4, (45, 310))
-            self.screen.blit(self.select_track_5, (30, 380))
-            self.screen.blit(self.select_track_6, (15, 450))
+            self.track_list.draw(self.screen, pygame.Rect(0, 0, self.width, 500), 250, (0, 510))
 
             self.screen.blit(self.select_edit, (15, self.height - 30))
             self.screen.blit(self.select_new, (165, self.height - 30))
+            self.screen.blit(self.select_search, (315, self.height - 30))
+            self.screen.blit(self.select_marathon, (465, self.height - 30))
+            self.screen.blit(self.select_sort_order, (15, self.height - 65))
+            self.screen.blit(self.select_difficulty_range, (315, self.height - 65))
             self.screen.blit(self.select_back, (self.width - 300, self.height - 30))
             self.screen.blit(self.select_play, (self.width - 150, self.height - 30))
 
-            if self.selected_tracks[3]:
-                self.screen.blit(self.select_track_title, (15, 525))
-                self.screen.blit(self.select_track_artist, (15, 600))
-                self.screen.blit(self.select_track_album, (15, 650))
-                self.screen.blit(self.select_track_high_score, (15, 700))
-                self.screen.blit(self.select_track_high_score_accuracy, (self.width * .3, 700))
-                self.screen.blit(self.select_track_high_score_layers, (self.width * .45, 700))
-                self.screen.blit(self.select_track_difficulty, (15, 750))
-
-                self.screen.blit(self.select_track_num_beats_A, (15, 800))
-                self.screen.blit(self.select_track_num_beats_B, (90, 800))
-                self.screen.blit(self.select_track_num_beats_C, (165, 800))
-                self.screen.blit(self.select_track_num_beats_D, (240, 800))
-                self.screen.blit(self.select_track_num_beats_E, (315, 800))
-                self.screen.blit(self.select_track_num_beats_F, (390, 800))
-                self.screen.blit(self.select_track_duration, (500, 800))
-
             pygame.display.flip()
 
             self.clock.tick(60)
@@ -345,24 +381,29 @@ class Menu:
                     if event.key == pygame.K_RETURN:
                         if label_selection_index == 0:
                             pygame.key.set_repeat()
-                            self.play_track(self.selected_tracks[3])
+                            self.play_track(self.selected_track)
                             self.current_screen = Menu.TRACK_SELECT
                             return
                         elif label_selection_index == 1:
                             # toggle prune unused layers
                             self.prune_unused_layers = not self.prune_unused_layers
-                        else:
+                        elif label_selection_index < 8:
                             # toggle enable for key
                             self.layers_keys[ALL_LAYERS[label_selection_index - 2]][0] = not self.layers_keys[ALL_LAYERS[label_selection_index - 2]][0]
                     elif event.key == pygame.K_BACKSPACE:
                         self.current_screen = Menu.TRACK_SELECT
                         return
                     elif event.key == pygame.K_DOWN:
-                        label_selection_index = min(7, label_selection_index + 1)
+                        label_selection_index = min(8, label_selection_index + 1)
                         break
                     elif event.key == pygame.K_UP:
                         label_selection_index = max(0, label_selection_index - 1)
                         break
+                    elif label_selection_index == 8:
+                        if event.key == pygame.K_LEFT:
+                            self.speed = max(.5, round(self.speed - .1, 1))
+                        elif event.key == pygame.K_RIGHT:
+                            self.speed = min(1.5, round(self.speed + .1, 1))
                     elif event.key != pygame.K_ESCAPE and event.key != pygame.K_SPACE:
                         if label_selection_index >= 2:
                             for key, value in self.layers_keys.items():
@@ -372,71 +413,81 @@ class Menu:
 
             self.screen.fill((0, 0, 0))
 
-            start_label = self.large_font.render('START', True, Menu.SELECTED_COLOR if label_selection_index == 0 else Menu.WHITE)
+            start_label = self.text_cache.render(self.large_font, 'START', Menu.SELECTED_COLOR if label_selection_index == 0 else Menu.WHITE)
             start_label_text_box = start_label.get_rect()
             start_label_text_box.center = self.width / 2, 200
             self.screen.blit(start_label, start_label_text_box)
 
-            prune_unused_layers_label = self.generic_font.render('Prune unused layers:', True, Menu.SELECTED_COLOR if label_selection_index == 1 else Menu.WHITE)
-            prune_unused_layers_enabled_label = self.generic_font.render(f'{self.prune_unused_layers}',
-                                                                         True, Menu.ENABLED_COLOR if self.prune_unused_layers else Menu.DISABLED_COLOR)
+            prune_unused_layers_label = self.text_cache.render(self.generic_font, 'Prune unused layers:', Menu.SELECTED_COLOR if label_selection_index == 1 else Menu.WHITE)
+            prune_unused_layers_enabled_label = self.text_cache.render(self.generic_font, f'{self.prune_unused_layers}',
+                                                                       Menu.ENABLED_COLOR if self.prune_unused_layers else Menu.DISABLED_COLOR)
             self.screen.blit(prune_unused_layers_label, (25, 275))
             self.screen.blit(prune_unused_layers_enabled_label, (325, 275))
 
             # A layer
-            A_label = self.generic_font.render('Layer A:', True, Menu.SELECTED_COLOR if label_selection_index == 2 else Menu.WHITE)
-            A_enabled_label = self.generic_font.render(f'{"Enabled" if self.layers_keys["A"][0] else "Disabled"}',
-                                                       True, Menu.ENABLED_COLOR if self.layers_keys["A"][0] else Menu.DISABLED_COLOR)
-            A_key_label = self.generic_font.render(f'Key: {None if self.layers_keys["A"][1] is None else pygame.key.name(self.layers_keys["A"][1])}', True, Menu.WHITE)
+            A_label = self.text_cache.render(self.generic_font, 'Layer A:', Menu.SELECTED_COLOR if label_selection_index == 2 else Menu.WHITE)
+            A_enabled_label = self.text_cache.render(self.generic_font, f'{"Enabled" if self.layers_keys["A"][0] else "Disabled"}',
+                                                     Menu.ENABLED_COLOR if self.layers_keys["A"][0] else Menu.DISABLED_COLOR)
+            A_key_label = self.text_cache.render(self.generic_font, f'Key: {None if self.layers_keys["A"][1] is None else pygame.key.name(self.layers_keys["A"][1])}', Menu.WHITE)
             self.screen.blit(A_label, (25, 350))
             self.screen.blit(A_enabled_label, (175, 350))
             self.screen.blit(A_key_label, (325, 350))
 
             # B layer
-            B_label = self.generic_font.render('Layer B:', True, Menu.SELECTED_COLOR if label_selection_index == 3 else Menu.WHITE)
-            B_enabled_label = self.generic_font.render(f'{"Enabled" if self.layers_keys["B"][0] else "Disabled"}',
-                                                       True, Menu.ENABLED_COLOR if self.layers_keys["B"][0] else Menu.DISABLED_COLOR)
-            B_key_label = self.generic_font.render(f'Key: {None if self.layers_keys["B"][1] is None else pygame.key.name(self.layers_keys["B"][1])}', True, Menu.WHITE)
+            B_label = self.text_cache.render(self.generic_font, 'Layer B:', Menu.SELECTED_COLOR if label_selection_index == 3 else Menu.WHITE)
+            B_enabled_label = self.text_cache.render(self.generic_font, f'{"Enabled" if self.layers_keys["B"][0] else "Disabled"}',
+                                                     Menu.ENABLED_COLOR if self.layers_keys["B"][0] else Menu.DISABLED_COLOR)
+            B_key_label = self.text_cache.render(self.generic_font, f'Key: {None if self.layers_keys["B"][1] is None else pygame.key.name(self.layers_keys["B"][1])}', Menu.WHITE)
             self.screen.blit(B_label, (25, 425))
             self.screen.blit(B_enabled_label, (175, 425))
             self.screen.blit(B_key_label, (325, 425))
 
             # C layer
-            C_label = self.generic_font.render('Layer C:', True, Menu.SELECTED_COLOR if label_selection_index == 4 else Menu.WHITE)
-            C_enabled_label = self.generic_font.render(f'{"Enabled" if self.layers_keys["C"][0] else "Disabled"}',
-                                                       True, Menu.ENABLED_COLOR if self.layers_keys["C"][0] else Menu.DISABLED_COLOR)
-            C_key_label = self.generic_font.render(f'Key: {None if self.layers_keys["C"][1] is None else pygame.key.name(self.layers_keys["C"][1])}', True, Menu.WHITE)
+            C_label = self.text_cache.render(self.generic_font, 'Layer C:', Menu.SELECTED_COLOR if label_selection_index == 4 else Menu.WHITE)
+            C_enabled_label = self.text_cache.render(self.generic_font, f'{"Enabled" if self.layers_keys["C"][0] else "Disabled"}',
+                                                     Menu.ENABLED_COLOR if self.layers_keys["C"][0] else Menu.DISABLED_COLOR)
+            C_key_label = self.text_cache.render(self.generic_font, f'Key: {None if self.layers_keys["C"][1] is None else pygame.key.name(self.layers_keys["C"][1])}', Menu.WHITE)
             self.screen.blit(C_label, (25, 500))
             self.screen.blit(C_enabled_label, (175, 500))
             self.screen.blit(C_key_label, (325, 500))
 
             # D layer
-            D_label = self.generic_font.render('Layer D:', True, Menu.SELECTED_COLOR if label_selection_index == 5 else Menu.WHITE)
-            D_enabled_label = self.generic_font.render(f'{"Enabled" if self.layers_keys["D"][0] else "Disabled"}',
-                                                       True, Menu.ENABLED_COLOR if self.layers_keys["D"][0] else Menu.DISABLED_COLOR)
-            D_key_label = self.generic_font.render(f'Key: {None if self.layers_keys["D"][1] is None else pygame.key.name(self.layers_keys["D"][1])}', True, Menu.WHITE)
+            D_label = self.text_cache.render(self.generic_font, 'Layer D:', Menu.SELECTED_COLOR if label_selection_index == 5 else Menu.WHITE)
+            D_enabled_label = self.text_cache.render(self.generic_font, f'{"Enabled" if self.layers_keys["D"][0] else "Disabled"}',
+                                                     Menu.ENABLED_COLOR if self.layers_keys["D"][0] else Menu.DISABLED_COLOR)
+            D_key_label = self.text_cache.render(self.generic_font, f'Key: {None if self.layers_keys["D"][1] is None else pygame.key.name(self.layers_keys["D"][1])}', Menu.WHITE)
             self.screen.blit(D_label, (25, 575))
             self.screen.blit(D_enabled_label, (175, 575))
             self.screen.blit(D_key_label, (325, 575))
 
             # E layer
-            E_label = self.generic_font.render('Layer E:', True, Menu.SELECTED_COLOR if label_selection_index == 6 else Menu.WHITE)
-            E_enabled_label = self.generic_font.render(f'{"Enabled" if self.layers_keys["E"][0] else "Disabled"}',
-                                                       True, Menu.ENABLED_COLOR if self.layers_keys["E"][0] else Menu.DISABLED_COLOR)
-            E_key_label = self.generic_font.render(f'Key: {None if self.layers_keys["E"][1] is None else pygame.key.name(self.layers_keys["E"][1])}', True, Menu.WHITE)
+            E_label = self.text_cache.render(self.generic_font, 'Layer E:', Menu.SELECTED_COLOR if label_selection_index == 6 else Menu.WHITE)
+            E_enabled_label = self.text_cache.render(self.generic_font, f'{"Enabled" if self.layers_keys["E"][0] else "Disabled"}',
+                                                     Menu.ENABLED_COLOR if self.layers_keys["E"][0] else Menu.DISABLED_COLOR)
+            E_key_label = self.text_cache.render(self.generic_font, f'Key: {None if self.layers_keys["E"][1] is None else pygame.key.name(self.layers_keys["E"][1])}', Menu.WHITE)
             self.screen.blit(E_label, (25, 650))
             self.screen.blit(E_enabled_label, (175, 650))
             self.screen.blit(E_key_label, (325, 650))
 
             # F layer
-            F_label = self.generic_font.render('Layer F:', True, Menu.SELECTED_COLOR if label_selection_index == 7 else Menu.WHITE)
-            F_enabled_label = self.generic_font.render(f'{"Enabled" if self.layers_keys["F"][0] else "Disabled"}',
-                                                       True, Menu.ENABLED_COLOR if self.layers_keys["F"][0] else Menu.DISABLED_COLOR)
-            F_key_label = self.generic_font.render(f'Key: {None if self.layers_keys["F"][1] is None else pygame.key.name(self.layers_keys["F"][1])}', True, Menu.WHITE)
+            F_label = self.text_cache.render(self.generic_font, 'Layer F:', Menu.SELECTED_COLOR if label_selection_index == 7 else Menu.WHITE)
+            F_enabled_label = self.text_cache.render(self.generic_font, f'{"Enabled" if self.layers_keys["F"][0] else "Disabled"}',
+                                                     Menu.ENABLED_COLOR if self.layers_keys["F"][0] else Menu.DISABLED_COLOR)
+            F_key_label = self.text_cache.render(self.generic_font, f'Key: {None if self.layers_keys["F"][1] is None else pygame.key.name(self.layers_keys["F"][1])}', Menu.WHITE)
             self.screen.blit(F_label, (25, 725))
             self.screen.blit(F_enabled_label, (175, 725))
             self.screen.blit(F_key_label, (325, 725))
 
+            # Speed
+            speed_label = self.text_cache.render(self.generic_font, 'Speed:', Menu.SELECTED_COLOR if label_selection_index == 8 else Menu.WHITE)
+            speed_value_label = self.text_cache.render(self.generic_font, f'◀ {self.speed:.1f}x ▶', Menu.WHITE if self.speed == 1 else Menu.DISABLED_COLOR)
+            self.screen.blit(speed_label, (25, 800))
+            self.screen.blit(speed_value_label, (175, 800))
+            if self.speed != 1:
+                practice_high_score = self.selected_track.get_practice_high_score(self.speed)
+                speed_high_score_label = self.text_cache.render(self.generic_font, f'Practice best: {practice_high_score[0]}', Menu.WHITE)
+                self.screen.blit(speed_high_score_label, (325, 800))
+
             self.screen.blit(self.setup_toggle, (self.width - 450, self.height - 30))
             self.screen.blit(self.setup_back, (self.width - 150, self.height - 30))
 
@@ -451,6 +502,7 @@ class Menu:
             clipboard = clipboard[1:-1]
         new_track_filepath = clipboard if isfile(clipboard) and clipboard[clipboard.rindex('.'):] in ('.flac', '.opus', '.mp3', '.m4a') else None
         new_track = Track(new_track_filepath) if new_track_filepath else None
+        import_directory = clipboard if isdir(clipboard) else None
 
         while 1:
             for event in pygame.event.get():
@@ -460,6 +512,7 @@ class Menu:
                             clipboard = paste()
                             new_track_filepath = clipboard if isfile(clipboard) and clipboard[clipboard.rindex('.'):] in ('.flac', '.opus', '.mp3', '.m4a') else None
                             new_track = Track(new_track_filepath) if new_track_filepath else None
+                            import_directory = clipboard if isdir(clipboard) else None
                             break
                         elif label_selection_index == 1:
                             new_track.set_title(paste())
@@ -472,14 +525,13 @@ class Menu:
                             break
                     elif event.key == pygame.K_s:
                         self.current_screen = Menu.TRACK_SELECT
-                        if new_track:
-                            new_index = self.library.add_track(new_track)
-                            self.save_library()
-                            if new_index is not None:
-                                self.track_selection_index = new_index
-                                self.selected_tracks = self.library.get_tracks(self.track_selection_index)
-                                self.render_selected_tracks()
-                                self.render_selected_track_data()
+                        if import_directory:
+                            self.import_directory(import_directory)
+                        elif new_track:
+                            if not self.library.contains(new_track):
+                                self.library.add_track(new_track)
+                                self.map_jobs.submit(new_track)
+                            self.update_selection(new_track)
                         return
                     elif event.key == pygame.K_BACKSPACE:
                         self.current_screen = Menu.TRACK_SELECT
@@ -493,23 +545,26 @@ class Menu:
 
             self.screen.fill((0, 0, 0))
 
-            new_track_file_text = self.generic_font.render('Paste filepath from clipboard', True,
-                                                           Menu.SELECTED_COLOR if label_selection_index == 0 else Menu.WHITE)
+            new_track_file_text = self.text_cache.render(self.generic_font, 'Paste filepath from clipboard',
+                                                         Menu.SELECTED_COLOR if label_selection_index == 0 else Menu.WHITE)
             new_track_file_text_box = new_track_file_text.get_rect()
             new_track_file_text_box.center = self.width / 2, 200
             self.screen.blit(new_track_file_text, new_track_file_text_box)
 
             clipboard = paste()
-            new_track_clipboard_text = self.small_font.render(f'Clipboard: {clipboard}', True, Menu.WHITE)
+            new_track_clipboard_text = self.text_cache.render(self.small_font, f'Clipboard: {clipboard}', Menu.WHITE)
             self.screen.blit(new_track_clipboard_text, (10, self.height - 200))
 
             self.screen.blit(self.new_track_edit, (15, self.height - 30))
             self.screen.blit(self.new_track_save, (self.width - 300, self.height - 30))
             self.screen.blit(self.new_track_cancel, (self.width - 150, self.height - 30))
 
-            self.screen.blit(self.generic_font.render(f'Title: {new_track.title if new_track else "None"}', True, Menu.SELECTED_COLOR if label_selection_index == 1 else Menu.WHITE), (10, 300))
-            self.screen.blit(self.generic_font.render(f'Artist: {new_track.artist if new_track else "None"}', True, Menu.SELECTED_COLOR if label_selection_index == 2 else Menu.WHITE), (10, 375))
-            self.screen.blit(self.generic_font.render(f'Album: {new_track.album if new_track else "None"}', True, Menu.SELECTED_COLOR if label_selection_index == 3 else Menu.WHITE), (10, 450))
+            if import_directory:
+                self.screen.blit(self.text_cache.render(self.generic_font, f'Import folder: {import_directory}', Menu.WHITE), (10, 525))
+
+            self.screen.blit(self.text_cache.render(self.generic_font, f'Title: {new_track.title if new_track else "None"}', Menu.SELECTED_COLOR if label_selection_index == 1 else Menu.WHITE), (10, 300))
+            self.screen.blit(self.text_cache.render(self.generic_font, f'Artist: {new_track.artist if new_track else "None"}', Menu.SELECTED_COLOR if label_selection_index == 2 else Menu.WHITE), (10, 375))
+            self.screen.blit(self.text_cache.render(self.generic_font, f'Album: {new_track.album if new_track else "None"}', Menu.SELECTED_COLOR if label_selection_index == 3 else Menu.WHITE), (10, 450))
 
             pygame.display.flip()
 
@@ -517,7 +572,7 @@ class Menu:
 
     def draw_edit_track(self):
         label_selection_index = 0
-        track = self.selected_tracks[3]
+        track = self.selected_track
 
         old_title = track.title
         old_artist = track.artist
@@ -537,22 +592,17 @@ class Menu:
                             track.set_album(paste())
                             break
                     elif event.key == pygame.K_d:
-                        track.delete_map()
+                        self.map_jobs.cancel(track)
                         self.library.remove_track(self.track_selection_index)
-                        self.save_library()
-                        if self.track_selection_index >= len(self.library.saved_tracks):
-                            self.track_selection_index -= 1
-                        self.selected_tracks = self.library.get_tracks(self.track_selection_index)
-                        self.render_selected_tracks()
-                        self.render_selected_track_data()
+                        # the same audio elsewhere in the library shares the map
+                        if track.map_filepath and not self.library.uses_map(track.map_filepath):
+                            track.delete_map()
+                        self.update_selection()
                         self.current_screen = Menu.TRACK_SELECT
                         return
                     elif event.key == pygame.K_s:
-                        if track.title != old_title:
-                            self.library.add_track(self.library.remove_track(self.track_selection_index))
-                        self.save_library()
-                        self.render_selected_tracks()
-                        self.render_selected_track_data()
+                        self.library.update_track(track, 'title', 'artist', 'album')
+                        self.update_selection(track)
                         self.current_screen = Menu.TRACK_SELECT
                         return
                     elif event.key == pygame.K_BACKSPACE:
@@ -571,7 +621,7 @@ class Menu:
             self.screen.fill((0, 0, 0))
 
             clipboard = paste()
-            edit_track_clipboard_text = self.small_font.render(f'Clipboard: {clipboard}', True, Menu.WHITE)
+            edit_track_clipboard_text = self.text_cache.render(self.small_font, f'Clipboard: {clipboard}', Menu.WHITE)
             self.screen.blit(edit_track_clipboard_text, (10, self.height - 200))
 
             self.screen.blit(self.new_track_edit, (15, self.height - 30))
@@ -579,16 +629,68 @@ class Menu:
             self.screen.blit(self.new_track_save, (self.width - 300, self.height - 30))
             self.screen.blit(self.new_track_cancel, (self.width - 150, self.height - 30))
 
-            self.screen.blit(self.generic_font.render(f'Title: {track.title}', True, Menu.SELECTED_COLOR if label_selection_index == 0 else Menu.WHITE), (10, 300))
-            self.screen.blit(self.generic_font.render(f'Artist: {track.artist}', True, Menu.SELECTED_COLOR if label_selection_index == 1 else Menu.WHITE), (10, 375))
-            self.screen.blit(self.generic_font.render(f'Album: {track.album}', True, Menu.SELECTED_COLOR if label_selection_index == 2 else Menu.WHITE), (10, 450))
+            self.screen.blit(self.text_cache.render(self.generic_font, f'Title: {track.title}', Menu.SELECTED_COLOR if label_selection_index == 0 else Menu.WHITE), (10, 300))
+            self.screen.blit(self.text_cache.render(self.generic_font, f'Artist: {track.artist}', Menu.SELECTED_COLOR if label_selection_index == 1 else Menu.WHITE), (10, 375))
+            self.screen.blit(self.text_cache.render(self.generic_font, f'Album: {track.album}', Menu.SELECTED_COLOR if label_selection_index == 2 else Menu.WHITE), (10, 450))
 
             pygame.display.flip()
 
             self.clock.tick(30)
 
     def draw_search(self):
-        pass
+        label_selection_index = 0
+        query = ''
+        results = []
+        pygame.key.start_text_input()
+        pygame.event.clear(pygame.TEXTINPUT)
+
+        while 1:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.current_screen = Menu.EXIT
+                    return
+                elif event.type == pygame.TEXTINPUT:
+                    query += event.text
+                    results = self.library.search(query)
+                    label_selection_index = 0
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_BACKSPACE:
+                        query = query[:-1]
+                        results = self.library.search(query)
+                        label_selection_index = 0
+                    elif event.key == pygame.K_DOWN:
+                        label_selection_index = min(len(results) - 1, label_selection_index + 1)
+                    elif event.key == pygame.K_UP:
+                        label_selection_index = max(0, label_selection_index - 1)
+                    elif event.key == pygame.K_RETURN:
+                        if results:
+                            # a track hidden by the difficulty filter shows the whole library
+                            if self.library.index_of(results[label_selection_index]) is None:
+                                self.library.set_difficulty_range(None)
+                                self.render_library_view_labels()
+                            self.update_selection(results[label_selection_index])
+                        self.current_screen = Menu.TRACK_SELECT
+                        return
+                    elif event.key == pygame.K_ESCAPE:
+                        self.current_screen = Menu.TRACK_SELECT
+                        return
+
+            self.screen.fill((0, 0, 0))
+
+            self.screen.blit(self.text_cache.render(self.large_font, f'Search: {query}', Menu.WHITE), (15, 30))
+            pygame.draw.line(self.screen, Menu.GRAY, (0, 90), (self.width, 90))
+
+            for i, track in enumerate(results):
+                color = Menu.SELECTED_COLOR if i == label_selection_index else Menu.WHITE
+                self.screen.blit(self.text_cache.render(self.generic_font, f'{track.title}', color), (15, 110 + i * 70))
+                self.screen.blit(self.text_cache.render(self.small_font, f'{track.artist} - {track.album}', Menu.GRAY), (30, 145 + i * 70))
+
+            self.screen.blit(self.search_select, (self.width - 350, self.height - 30))
+            self.screen.blit(self.search_back, (self.width - 150, self.height - 30))
+
+            pygame.display.flip()
+
+            self.clock.tick(60)
 
     def display_loop(self):
         while 1:
@@ -596,24 +698,121 @@ class Menu:
             if self.current_screen == 0:
                 break
 
+    @staticmethod
+    def is_playable(track):
+        # files are checked in the background after the library loads
+        if track.missing is None:
+            track.check_files()
+        return track.status == Track.READY and not track.missing
+
+    def create_game(self, track, enabled_layers_keys, **kwargs):
+        return Game(self.screen, self.width, self.height, self.audio_player, track, enabled_layers_keys, self.preview_length, self.lenience, self.prune_unused_layers, self.play_hit_sound, self.hit_sounds, self.text_cache,
+                    speed=self.speed, max_frame_rate=self.max_frame_rate, **kwargs)
+
     def play_track(self, track):
-        if isfile(track.audio_filepath) and isfile(track.map_filepath):
+        if Menu.is_playable(track):
             self.audio_player.idle.wait()
             enabled_layers_keys = {layer: key[1] for layer, key in self.layers_keys.items() if key[0]}
-            game = Game(self.screen, self.width, self.height, self.audio_player, track, enabled_layers_keys, self.preview_length, self.lenience, self.prune_unused_layers, self.latency, self.play_hit_sound, [self.bass_hit_sound_data, self.high_hit_sound_data])
+            game = self.create_game(track, enabled_layers_keys)
             game.start_game()
+            while game.restart:
+                # restarting while practicing a loop starts at the loop and keeps looping it
+                self.audio_player.idle.wait()
+                game = self.create_game(track, enabled_layers_keys, start_time=game.loop_start or 0, loop_start=game.loop_start, loop_end=game.loop_end)
+                game.start_game()
+            self.library.update_track(track, 'high_score', 'high_score_accuracy', 'high_score_layers', 'practice_high_scores')
+            self.update_selection(track)
+
+    def prefetch_track(self, track, layers):
+        self.audio_player.prefetch(track.audio_filepath, self.speed)
+        return self.prefetcher.submit(read_map, track.map_filepath, layers)
+
+    def play_marathon(self):
+        # plays the selected track and those after it back to back with scores carried over, each next track is
+        # decoded and its map read while the current one plays, and queued to follow it in the stream without a gap
+        tracks = [track for track in self.library.get_track_range(self.track_selection_index, self.track_selection_index + self.marathon_length)
+                  if Menu.is_playable(track)]
+        if not tracks:
+            return
+        enabled_layers_keys = {layer: key[1] for layer, key in self.layers_keys.items() if key[0]}
+
+        next_layer_beats = self.prefetcher.submit(read_map, tracks[0].map_filepath, set(enabled_layers_keys))
+        previous_game = None
+        for i, track in enumerate(tracks):
+            is_last = i == len(tracks) - 1
+            layer_beats = next_layer_beats.result()
+            if not is_last:
+                next_layer_beats = self.prefetch_track(tracks[i + 1], set(enabled_layers_keys))
+
+            # unless the previous track ended early, this one already took over the stream and the next is queued to
+            # follow it
+            game = self.create_game(track, enabled_layers_keys, layer_beats=layer_beats, previous_game=previous_game, show_score=is_last)
+            continued = previous_game is not None and previous_game.next_started
+            if not continued:
+                self.audio_player.idle.wait()
+            if not is_last:
+                self.audio_player.queue_audio(tracks[i + 1].audio_filepath)
+            if continued:
+                game.continue_game()
+            else:
+                game.start_game()
             while game.restart:
                 self.audio_player.idle.wait()
-                game = Game(self.screen, self.width, self.height, self.audio_player, track, enabled_layers_keys, self.preview_length, self.lenience, self.prune_unused_layers, self.latency, self.play_hit_sound, [self.bass_hit_sound_data, self.high_hit_sound_data])
+                if not is_last:
+                    self.audio_player.queue_audio(tracks[i + 1].audio_filepath)
+                game = self.create_game(track, enabled_layers_keys, start_time=game.loop_start or 0, loop_start=game.loop_start, loop_end=game.loop_end,
+                                        previous_game=previous_game, show_score=is_last)
                 game.start_game()
-            self.save_library()
-            self.render_selected_track_data()
 
-    def save_library(self):
-        dump(self.library, open('library/saved.library', 'wb'))
+            # the last track records its high score from the score screen
+            if game.finished and not is_last:
+                game.record_high_score()
+            self.library.update_track(track, 'high_score', 'high_score_accuracy', 'high_score_layers', 'practice_high_scores')
+            if not game.finished:
+                break
+            previous_game = game
+        self.update_selection(self.selected_track)
+
+    def import_directory(self, directory):
+        importer = Importer(self.library, directory)
+        while not importer.is_done():
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or event.type == pygame.KEYDOWN and event.key == pygame.K_BACKSPACE:
+                    importer.cancel()
+
+            importer.poll()
+
+            self.screen.fill((0, 0, 0))
+
+            import_text = self.text_cache.render(self.large_font, f'Importing {importer.count_done()}/{importer.num_total}', Menu.WHITE)
+            import_text_box = import_text.get_rect()
+            import_text_box.center = self.width / 2, 200
+            self.screen.blit(import_text, import_text_box)
+
+            pygame.draw.rect(self.screen, Menu.GRAY, (15, 300, self.width - 30, 30), 1)
+            pygame.draw.rect(self.screen, Menu.SELECTED_COLOR, (15, 300, (self.width - 30) * importer.count_done() / max(1, importer.num_total), 30))
+
+            if importer.num_failed:
+                self.screen.blit(self.text_cache.render(self.generic_font, f'Failed: {importer.num_failed}', Menu.DISABLED_COLOR), (15, 375))
+            if importer.last_filepath:
+                self.screen.blit(self.text_cache.render(self.small_font, f'{importer.last_filepath}', Menu.WHITE), (15, self.height - 200))
+
+            self.screen.blit(self.new_track_cancel, (self.width - 150, self.height - 30))
+
+            pygame.display.flip()
+
+            self.clock.tick(30)
+        importer.finish()
+
+        self.update_selection(self.selected_track)
 
     def close_menu(self):
-        self.save_library()
+        self.map_jobs.cancel_all()
+        self.update_generated_tracks()
+        self.library.close()
+        Track.metadata_cache.close()
         self.audio_player.idle.wait()
         self.audio_player.close()
+        self.pcm_cache.close()
+        self.prefetcher.shutdown(wait=False, cancel_futures=True)
         pygame.display.quit()
@@ -0,0 +1,39 @@
+from os import stat
+import sqlite3
+
+
+class MetadataCache:
+    # tags and duration read from audio files, only trusted while the file's size and modification time are unchanged
+
+    def __init__(self, filepath='library/metadata.db'):
+        self.connection = sqlite3.connect(filepath, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                                    'audio_filepath TEXT PRIMARY KEY, '
+                                    'size INTEGER, '
+                                    'mtime_ns INTEGER, '
+                                    'title TEXT, '
+                                    'artist TEXT, '
+                                    'album TEXT, '
+                                    'duration REAL)')
+
+    @staticmethod
+    def get_file_key(audio_filepath):
+        audio_stat = stat(audio_filepath)
+        return audio_stat.st_size, audio_stat.st_mtime_ns
+
+    def get(self, audio_filepath, file_key):
+        # (title, artist, album, duration) or None
+        return self.connection.execute('SELECT title, artist, album, duration FROM metadata '
+                                       'WHERE audio_filepath = ? AND size = ? AND mtime_ns = ?',
+                                       (audio_filepath, *file_key)).fetchone()
+
+    def put(self, audio_filepath, file_key, title, artist, album, duration):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (audio_filepath, *file_key, title, artist, album, duration))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,80 @@
+from array import array
+from collections import deque
+from operator import add
+from sys import byteorder
+import wave
+
+
+class HitSoundMixer:
+    def __init__(self, sample_rate, channels, max_voices=8):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_voices = max_voices  # beyond this the oldest voices are cut off
+
+        self.sounds = {}  # name -> 16 bit samples, gain applied
+        self.scheduled = deque()  # (samples, start frame), appended by the game and taken by the output callback
+        self.voices = []  # [samples, next sample, start frame], only touched by the output callback
+
+    def load_sound(self, name, filepath, gain=1.0):
+        with wave.open(filepath, 'rb') as f:
+            if (f.getframerate(), f.getnchannels(), f.getsampwidth()) != (self.sample_rate, self.channels, 2):
+                print(f'ERROR: {filepath} is not {self.sample_rate} Hz {self.channels} channel 16 bit audio.')
+                return
+            samples = array('h', f.readframes(f.getnframes()))
+        if byteorder == 'big':
+            samples.byteswap()
+        if gain != 1:
+            samples = array('h', (max(-32768, min(32767, round(sample * gain))) for sample in samples))
+        self.sounds[name] = samples
+
+    def schedule(self, name, frame):
+        samples = self.sounds.get(name)
+        if samples is not None:
+            self.scheduled.append((samples, frame))
+
+    def is_active(self):
+        return bool(self.voices or self.scheduled)
+
+    def clear(self):
+        self.scheduled.clear()
+        self.voices = []
+
+    def mix(self, output, start_frame):
+        # adds the voices sounding in this buffer into output, a view of native 16 bit samples starting at start_frame.
+        # only the span of the buffer the voices overlap is copied out, mixed, clipped and written back
+        while self.scheduled:
+            samples, frame = self.scheduled.popleft()
+            self.voices.append([samples, 0, frame])
+        if len(self.voices) > self.max_voices:
+            del self.voices[:len(self.voices) - self.max_voices]
+
+        output_samples = output.cast('h')
+        num_samples = len(output_samples)
+        end_frame = start_frame + num_samples // self.channels
+        spans = []  # (voice, offset in output, number of samples)
+        span_start = num_samples
+        span_end = 0
+        for voice in self.voices:
+            samples, position, voice_start = voice
+            if voice_start < end_frame:
+                # voices scheduled for a frame already played start right away
+                offset = max(0, voice_start - start_frame) * self.channels
+                num_mixed = min(num_samples - offset, len(samples) - position)
+                spans.append((voice, offset, num_mixed))
+                span_start = min(span_start, offset)
+                span_end = max(span_end, offset + num_mixed)
+        if not spans:
+            return
+
+        mixed = output_samples[span_start:span_end].tolist()
+        for voice, offset, num_mixed in spans:
+            samples, position, _ = voice
+            offset -= span_start
+            mixed[offset:offset + num_mixed] = map(add, mixed[offset:offset + num_mixed], samples[position:position + num_mixed])
+            voice[1] = position + num_mixed
+        if max(mixed) > 32767 or min(mixed) < -32768:
+            mixed = [max(-32768, min(32767, sample)) for sample in mixed]
+        output_samples[span_start:span_end] = array('h', mixed)
+
+        if any(voice[1] == len(voice[0]) for voice, _, _ in spans):
+            self.voices = [voice for voice in self.voices if voice[1] < len(voice[0])]
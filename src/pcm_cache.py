@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from hashlib import sha1
+from mmap import ACCESS_READ, mmap
+from os import listdir, makedirs, remove, replace, stat, utime
+from os.path import getsize, join, realpath
+from tempfile import mkstemp
+from threading import Lock
+
+
+class CacheWriter:
+    # decoded audio is written to a temporary file and only enters the cache once complete
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        file_descriptor, self.temp_filepath = mkstemp('.part', dir=cache.directory)
+        self.file = open(file_descriptor, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def commit(self):
+        self.file.close()
+        self.cache.add(self.key, self.temp_filepath)
+
+    def discard(self):
+        self.file.close()
+        remove(self.temp_filepath)
+        self.cache.release(self.key)
+
+
+class PCMCache:
+    def __init__(self, directory='library/cache', max_disk_bytes=4 * 1024 ** 3, max_memory_bytes=1024 ** 3):
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+
+        self.lock = Lock()
+        self.pending = set()  # keys of decodes still being written
+        self.mapped = OrderedDict()  # key -> mmap, least recently used first
+        self.memory_bytes = 0
+
+        # cached files, least recently used first
+        files = []
+        for filename in listdir(directory):
+            filepath = join(directory, filename)
+            if filename.endswith('.part'):
+                remove(filepath)  # left by an interrupted decode
+            elif filename.endswith('.pcm'):
+                file_stat = stat(filepath)
+                files.append((file_stat.st_mtime, filename[:-4], file_stat.st_size))
+        files.sort()
+        self.files = OrderedDict((key, size) for _, key, size in files)  # key -> bytes
+        self.disk_bytes = sum(self.files.values())
+
+    @staticmethod
+    def get_key(audio_filepath, pcm_format):
+        audio_stat = stat(audio_filepath)
+        return sha1(f'{realpath(audio_filepath)}\0{audio_stat.st_mtime_ns}\0{audio_stat.st_size}\0{pcm_format}'.encode()).hexdigest()
+
+    def get_filepath(self, key):
+        return join(self.directory, f'{key}.pcm')
+
+    def contains(self, audio_filepath, pcm_format):
+        try:
+            return PCMCache.get_key(audio_filepath, pcm_format) in self.files
+        except OSError:
+            return False
+
+    def open(self, audio_filepath, pcm_format):
+        try:
+            key = PCMCache.get_key(audio_filepath, pcm_format)
+        except OSError:
+            return None
+
+        # a decode still being written, after a song was stopped early or by a prefetch, isn't waited for, the caller
+        # streams from ffmpeg instead so opening never blocks
+        with self.lock:
+            if key in self.pending:
+                return None
+            if key in self.mapped:
+                self.mapped.move_to_end(key)
+                return self.mapped[key]
+            if key not in self.files:
+                return None
+
+            filepath = self.get_filepath(key)
+            self.files.move_to_end(key)
+            try:
+                utime(filepath)
+                with open(filepath, 'rb') as f:
+                    data = mmap(f.fileno(), 0, access=ACCESS_READ)
+            except (OSError, ValueError):
+                self.remove_file(key)
+                return None
+            self.mapped[key] = data
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.max_memory_bytes and len(self.mapped) > 1:
+                self.unmap(next(iter(self.mapped)))
+            return data
+
+    def create(self, audio_filepath, pcm_format):
+        try:
+            key = PCMCache.get_key(audio_filepath, pcm_format)
+        except OSError:
+            return None
+        with self.lock:
+            if key in self.pending:
+                return None
+            self.pending.add(key)
+        return CacheWriter(self, key)
+
+    def add(self, key, temp_filepath):
+        size = getsize(temp_filepath)
+        with self.lock:
+            if size:
+                replace(temp_filepath, self.get_filepath(key))
+                self.disk_bytes += size - self.files.pop(key, 0)
+                self.files[key] = size
+                while self.disk_bytes > self.max_disk_bytes and len(self.files) > 1:
+                    self.remove_file(next(iter(self.files)))
+            else:
+                remove(temp_filepath)
+        self.release(key)
+
+    def release(self, key):
+        self.pending.discard(key)
+
+    def unmap(self, key):
+        data = self.mapped.pop(key)
+        self.memory_bytes -= len(data)
+        data.close()
+
+    def remove_file(self, key):
+        if key in self.mapped:
+            self.unmap(key)
+        self.disk_bytes -= self.files.pop(key)
+        try:
+            remove(self.get_filepath(key))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self.lock:
+            while self.mapped:
+                self.unmap(next(iter(self.mapped)))
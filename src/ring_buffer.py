@@ -0,0 +1,35 @@
+class RingBuffer:
+    # single producer, single consumer byte ring, the read and write counters are each only advanced by one side
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.size = size
+        self.read_count = 0
+        self.write_count = 0
+
+    def count_readable(self):
+        return self.write_count - self.read_count
+
+    def count_writable(self):
+        return self.size - (self.write_count - self.read_count)
+
+    def write(self, data):
+        num_bytes = min(len(data), self.count_writable())
+        start = self.write_count % self.size
+        first_part = min(num_bytes, self.size - start)
+        self.view[start:start + first_part] = data[:first_part]
+        self.view[:num_bytes - first_part] = data[first_part:num_bytes]
+        self.write_count += num_bytes
+        return num_bytes
+
+    def read_into(self, output, num_bytes):
+        num_bytes = min(num_bytes, self.count_readable())
+        start = self.read_count % self.size
+        first_part = min(num_bytes, self.size - start)
+        output[:first_part] = self.view[start:start + first_part]
+        output[first_part:num_bytes] = self.view[:num_bytes - first_part]
+        self.read_count += num_bytes
+        return num_bytes
+
+    def clear(self):
+        self.read_count = self.write_count
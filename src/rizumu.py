@@ -5,25 +5,27 @@ from sys import exit
 
 from menu import Menu
 
-# Check cwd
-if not getcwd().endswith('rizumu'):
-    print('Error: rizumu must be run from the base directory (rizumu/)\nExiting...')
-    exit()
+# Guarded so import worker processes can re-import this module
+if __name__ == '__main__':
+    # Check cwd
+    if not getcwd().endswith('rizumu'):
+        print('Error: rizumu must be run from the base directory (rizumu/)\nExiting...')
+        exit()
 
-# Check ctaff dependency
-if not isfile('bin/ctaff'):
-    print('Error: rizumu requires ctaff to be compiled to rizumu/bin/\nExiting...')
-    exit()
+    # Check ctaff dependency
+    if not isfile('bin/ctaff'):
+        print('Error: rizumu requires ctaff to be compiled to rizumu/bin/\nExiting...')
+        exit()
 
-# Make required directories
-try:
-    mkdir('library/')
-except FileExistsError:
-    pass
-try:
-    mkdir('library/maps')
-except FileExistsError:
-    pass
+    # Make required directories
+    try:
+        mkdir('library/')
+    except FileExistsError:
+        pass
+    try:
+        mkdir('library/maps')
+    except FileExistsError:
+        pass
 
-# Open menu
-menu = Menu()
+    # Open menu
+    menu = Menu()
@@ -0,0 +1,128 @@
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from heapq import nlargest
+from itertools import count
+from math import ceil
+from re import compile
+
+WORD_PATTERN = compile(r'[^\W_]+')
+
+
+def get_words(text):
+    return WORD_PATTERN.findall(text.lower())
+
+
+def get_trigrams(words):
+    trigrams = set()
+    for word in words:
+        padded_word = f' {word} '
+        trigrams.update(padded_word[i:i + 3] for i in range(len(padded_word) - 2))
+    return trigrams
+
+
+class SearchIndex:
+
+    MATCH_THRESHOLD = .6  # fraction of query trigrams a fuzzy match must contain
+    COMMON_TRIGRAM_FRACTION = .05  # trigrams in more tracks than this are ignored by fuzzy matching
+
+    def __init__(self, tracks=()):
+        self.next_id = count()
+        self.ids = {}  # audio filepath -> track id
+        self.tracks = {}  # track id -> (track, word entries, trigrams)
+        self.words = []  # sorted (word, field rank, track id), field ranks are title 0, artist 1, album 2
+        self.postings = defaultdict(set)  # trigram -> track ids
+
+        for track in tracks:
+            self.add_track(track, sort=False)
+        self.words.sort()
+
+    def add_track(self, track, sort=True):
+        if track.audio_filepath in self.ids:
+            self.remove_track(track)
+        track_id = next(self.next_id)
+
+        entries = []
+        all_words = []
+        for rank, field in enumerate((track.title, track.artist, track.album)):
+            words = get_words(field)
+            all_words += words
+            entries += [(word, rank, track_id) for word in words]
+        if sort:
+            for entry in entries:
+                insort(self.words, entry)
+        else:
+            self.words += entries
+
+        trigrams = get_trigrams(all_words)
+        for trigram in trigrams:
+            self.postings[trigram].add(track_id)
+
+        self.ids[track.audio_filepath] = track_id
+        self.tracks[track_id] = (track, entries, trigrams)
+
+    def remove_track(self, track):
+        track_id = self.ids.pop(track.audio_filepath, None)
+        if track_id is None:
+            return
+        _, entries, trigrams = self.tracks.pop(track_id)
+        for entry in entries:
+            del self.words[bisect_left(self.words, entry)]
+        for trigram in trigrams:
+            posting = self.postings[trigram]
+            posting.discard(track_id)
+            if not posting:
+                del self.postings[trigram]
+
+    def get_word_range(self, prefix):
+        start_index = bisect_left(self.words, (prefix,))
+        end_index = bisect_left(self.words, (prefix + '\U0010ffff',), start_index)
+        return start_index, end_index
+
+    def search(self, query, limit=10):
+        query_words = get_words(query)
+        if not query_words:
+            return []
+
+        # every query word must prefix a word of the track, scan the narrowest word in order
+        word_ranges = sorted((self.get_word_range(word) for word in query_words), key=lambda word_range: word_range[1] - word_range[0])
+        required_ids = None
+        for start_index, end_index in word_ranges[1:]:
+            word_ids = {entry[2] for entry in self.words[start_index:end_index]}
+            required_ids = word_ids if required_ids is None else required_ids & word_ids
+
+        title_matches = []
+        other_matches = []
+        seen_ids = set()
+        start_index, end_index = word_ranges[0]
+        for i in range(start_index, end_index):
+            _, rank, track_id = self.words[i]
+            if track_id in seen_ids or required_ids is not None and track_id not in required_ids:
+                continue
+            if rank == 0:
+                title_matches.append(track_id)
+                seen_ids.add(track_id)
+                if len(title_matches) == limit:
+                    break
+            elif len(other_matches) < limit:
+                other_matches.append(track_id)
+                seen_ids.add(track_id)
+        matches = (title_matches + [track_id for track_id in other_matches if track_id not in title_matches])[:limit]
+
+        # otherwise fall back to fuzzy trigram matches, for typos and missing spaces
+        if not matches and len(''.join(query_words)) >= 3:
+            max_posting_size = max(1, int(len(self.tracks) * SearchIndex.COMMON_TRIGRAM_FRACTION))
+            postings = sorted((self.postings.get(trigram, set()) for trigram in get_trigrams(query_words)), key=len)
+            selective_postings = [posting for posting in postings if len(posting) <= max_posting_size] or postings[:3]
+            num_required = ceil(len(selective_postings) * SearchIndex.MATCH_THRESHOLD)
+
+            counts = Counter()
+            for posting in selective_postings:
+                counts.update(posting)
+            candidates = nlargest(limit * 4, counts.items(), key=lambda item: item[1])
+            candidates.sort(key=lambda item: (-item[1], len(self.tracks[item[0]][2])))  # prefer tracks with less text
+            for track_id, num_matched in candidates:
+                if len(matches) == limit or num_matched < num_required:
+                    break
+                matches.append(track_id)
+
+        return [self.tracks[track_id][0] for track_id in matches]
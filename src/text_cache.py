@@ -0,0 +1,44 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+from pygame import Rect
+from pygame.font import Font
+
+
+@lru_cache(maxsize=None)
+def load_font(size):
+    # fonts are shared by the menu and every game instead of being loaded again
+    return Font('font/unifont.ttf', size)
+
+
+class TextCache:
+    def __init__(self, max_surfaces=512):
+        self.surfaces = OrderedDict()  # (font, text, color) -> surface, least recently used first
+        self.max_surfaces = max_surfaces
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.max_surfaces:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+    def blit_glyphs(self, screen, font, text, color, position, centered=False):
+        # compose frequently changing text (clocks, counters) from cached single character glyphs
+        glyphs = [self.render(font, char, color) for char in text]
+        x, y = position
+        if centered:
+            x -= sum(glyph.get_width() for glyph in glyphs) / 2
+            y -= font.get_height() / 2
+        blits = []
+        start_x = x
+        for glyph in glyphs:
+            blits.append((glyph, (x, y)))
+            x += glyph.get_width()
+        screen.fblits(blits)
+        return Rect(start_x, y, x - start_x, font.get_height())
@@ -1,31 +1,82 @@
-from os import remove
-from subprocess import Popen
+from functools import lru_cache
+from hashlib import sha1
+from json import loads
+from os import close, remove, utime
+from os.path import isfile
+from subprocess import PIPE, Popen
+from tempfile import mkstemp
 
 from mutagen.flac import FLAC
 from mutagen.mp3 import MP3
 from mutagen.mp4 import MP4
 from mutagen.oggopus import OggOpus
 
+from beatmap import convert_map, count_beats
+from metadata_cache import MetadataCache
 from util import ALL_LAYERS
 
 
+@lru_cache
+def get_ctaff_version():
+    # ctaff has no version flag, any change to the binary counts as a new version
+    with open('bin/ctaff', 'rb') as f:
+        return sha1(f.read()).hexdigest()
+
+
 class Track:
-    def __init__(self, audio_filepath, map_filepath=None):
+
+    READY = 'ready'
+    GENERATING = 'generating'
+    FAILED = 'failed'
+
+    TAG_FIELDS = ('title', 'artist', 'album', 'duration')
+    metadata_cache = None  # MetadataCache shared by the tracks of this process, tags are always parsed without one
+
+    def __init__(self, audio_filepath, map_filepath=None, read_tags=True, encoded_fields=None):
         self.audio_filepath = audio_filepath
         self.map_filepath = map_filepath
-        self.title = None
-        self.artist = None
-        self.album = None
-        self.duration = 0
-        self.num_beats = {layer: 0 for layer in ALL_LAYERS}
+        # with read_tags the tags are read from the audio file (or the metadata cache) when first used
+        if not read_tags:
+            self.title = None
+            self.artist = None
+            self.album = None
+            self.duration = 0
+        # fields loaded from the library store as json are decoded when first used
+        self.encoded_fields = encoded_fields or {}
+        if 'num_beats' not in self.encoded_fields:
+            self.num_beats = {layer: 0 for layer in ALL_LAYERS}
         self.difficulty = None
         self.high_score = 0
         self.high_score_accuracy = 0
         self.high_score_layers = None
-
-        self.get_tags()
+        if 'practice_high_scores' not in self.encoded_fields:
+            self.practice_high_scores = {}  # speed label -> [score, accuracy, layers], for plays at other speeds
+
+        self.status = Track.READY
+        self.process = None  # ffmpeg or ctaff, while generating the map
+        self.missing = None  # audio or map file gone, None until checked
+
+    def __getattr__(self, name):
+        # only reached for attributes that aren't set, tags not read yet or stored fields not decoded yet
+        if name in Track.TAG_FIELDS:
+            self.get_tags()
+            return self.__dict__[name]
+        encoded_fields = self.__dict__.get('encoded_fields')
+        if encoded_fields and name in encoded_fields:
+            value = encoded_fields.pop(name)
+            setattr(self, name, {} if value is None else loads(value))
+            return self.__dict__[name]
+        raise AttributeError(name)
 
     def get_tags(self):
+        file_key = None
+        if Track.metadata_cache:
+            file_key = MetadataCache.get_file_key(self.audio_filepath)
+            metadata = Track.metadata_cache.get(self.audio_filepath, file_key)
+            if metadata:
+                self.title, self.artist, self.album, self.duration = metadata
+                return
+
         file_extension = self.audio_filepath[self.audio_filepath.rindex('.'):]
         if file_extension == '.flac':
             reader = FLAC(self.audio_filepath)
@@ -80,28 +131,67 @@ class Track:
             self.duration = float(info.length)
 
         else:
+            self.title = self.artist = self.album = None
+            self.duration = 0
             return
 
+        if Track.metadata_cache:
+            Track.metadata_cache.put(self.audio_filepath, file_key, self.title, self.artist, self.album, self.duration)
+
+    def check_files(self):
+        self.missing = not isfile(self.audio_filepath) or self.status == Track.READY and not (self.map_filepath and isfile(self.map_filepath))
+
+    def get_map_filepath(self):
+        # maps are named by a hash of the decoded audio and the ctaff build, so the same audio shares one map whatever
+        # its tags or container
+        self.process = Popen(['ffmpeg', '-nostdin', '-v', 'error', '-i', self.audio_filepath, '-map', '0:a:0', '-c:a', 'pcm_s16le',
+                              '-f', 'hash', '-hash', 'sha256', '-'], stdout=PIPE)
+        output = self.process.communicate()[0]
+        return_code = self.process.returncode
+        self.process = None
+        if return_code != 0:
+            raise ChildProcessError(f'ffmpeg exited with code {return_code}')
+        audio_digest = output.decode().strip().partition('=')[2]
+        return f'library/maps/{sha1(f"{audio_digest} {get_ctaff_version()}".encode()).hexdigest()}.map'
+
     def generate_track_file(self):
-        if not self.map_filepath:
-            cleaned_artist = self.artist.replace('/', '／').replace('"', '')
-            cleaned_title = self.title.replace('/', '／').replace('"', '')
-            cleaned_album = self.album.replace('/', '／').replace('"', '')
-            self.map_filepath = f'library/maps/{cleaned_artist} - {cleaned_title} - {cleaned_album}.map'
+        self.map_filepath = self.get_map_filepath()
         cleaned_audio_filepath = self.audio_filepath.replace('"', r'\"')
 
-        Popen(['bin/ctaff', '-i', f'{str(cleaned_audio_filepath)}', '-o', f'{self.map_filepath}']).wait()
-
-        with open(self.map_filepath, 'rb') as f:
-            while 1:
-                beat_layer = f.read(1).decode('ascii')
-                if not beat_layer:
-                    break
-                f.read(4)  # discard beat time
-                self.num_beats[beat_layer] += 1
+        # ctaff only runs for audio without a map, maps are complete once they exist. a reused map is touched so the
+        # library's orphaned map sweep doesn't take it before the track is added
+        if isfile(self.map_filepath):
+            utime(self.map_filepath)
+        else:
+            # ctaff writes to a partial file first so an interrupted ctaff never leaves a truncated map behind, unique as
+            # the same audio can be imported from two paths at once
+            file_descriptor, legacy_filepath = mkstemp('.ctaff.part', dir='library/maps')
+            close(file_descriptor)
+            self.process = Popen(['bin/ctaff', '-i', f'{str(cleaned_audio_filepath)}', '-o', legacy_filepath])
+            return_code = self.process.wait()
+            self.process = None
+            try:
+                if return_code != 0:
+                    raise ChildProcessError(f'ctaff exited with code {return_code}')
+                convert_map(legacy_filepath, self.map_filepath, self.duration)
+            finally:
+                try:
+                    remove(legacy_filepath)
+                except OSError:
+                    pass
+
+        self.num_beats = count_beats(self.map_filepath)
 
         self.difficulty = round(sum((self.num_beats[layer] for layer in ALL_LAYERS)) / self.duration, 1)
 
+    def cancel_generation(self):
+        process = self.process
+        if process:
+            process.kill()
+
+    def set_status(self, status):
+        self.status = status
+
     def set_map_filepath(self, map_filepath):
         self.map_filepath = map_filepath
 
@@ -123,6 +213,16 @@ class Track:
     def set_high_score_layers(self, layers):
         self.high_score_layers = layers
 
+    @staticmethod
+    def get_speed_label(speed):
+        return f'{speed:.1f}'
+
+    def get_practice_high_score(self, speed):
+        return self.practice_high_scores.get(Track.get_speed_label(speed), [0, 0, None])
+
+    def set_practice_high_score(self, speed, score, accuracy, layers):
+        self.practice_high_scores[Track.get_speed_label(speed)] = [score, accuracy, layers]
+
     def delete_map(self):
         try:
             remove(self.map_filepath)
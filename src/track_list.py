@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from time import perf_counter
+
+import pygame
+
+
+class TrackList:
+    # the track select list over the library's view. only rows in sight are drawn, each track's row and details panel
+    # are rendered once and kept until their text changes or they fall out of the caches, and rows coming up in the
+    # scroll direction are rendered before they scroll into view
+
+    ROW_SPACING = 70
+    NUM_ROWS = 7  # rows in sight, the selection is in the middle
+    PRERENDER_ROWS = 8  # rows ahead of the scroll direction kept rendered
+    MAX_PRERENDERS = 2  # rows prerendered per frame
+    SCROLL_RATE = 20  # per second, the fraction of the distance to the selection scrolled each frame is this times the frame time
+
+    def __init__(self, library, font, get_row, get_details, details_size, max_rows=256, max_details=32):
+        self.library = library
+        self.font = font
+        self.get_row = get_row  # track -> (text, color)
+        self.get_details = get_details  # track -> [(font, text, color, position in panel)]
+        self.details_size = details_size
+
+        self.rows = OrderedDict()  # audio filepath -> (text, color, surface), least recently used first
+        self.max_rows = max_rows
+        self.details = OrderedDict()  # audio filepath -> (details, surface), least recently used first
+        self.max_details = max_details
+
+        self.scroll_position = 0.0  # index of the row in the middle, between rows while scrolling
+        self.direction = 1  # of the last move, rows are prerendered this way
+        self.selection_index = 0
+        self.last_draw_time = perf_counter()
+
+    def select(self, index):
+        if index != self.selection_index:
+            self.direction = 1 if index > self.selection_index else -1
+        self.selection_index = index
+        # far jumps (page, home, end) scroll in from a page away
+        if abs(index - self.scroll_position) > TrackList.NUM_ROWS:
+            self.scroll_position = index - self.direction * TrackList.NUM_ROWS / 2
+
+    def get_row_surface(self, track):
+        text, color = self.get_row(track)
+        row = self.rows.get(track.audio_filepath)
+        if row is None or row[0] != text or row[1] != color:
+            row = text, color, self.font.render(text, True, color)
+            self.rows[track.audio_filepath] = row
+            if len(self.rows) > self.max_rows:
+                self.rows.popitem(last=False)
+        else:
+            self.rows.move_to_end(track.audio_filepath)
+        return row[2]
+
+    def is_row_rendered(self, track):
+        row = self.rows.get(track.audio_filepath)
+        return row is not None and row[:2] == self.get_row(track)
+
+    def get_details_surface(self, track, render=True):
+        details = self.get_details(track)
+        cached = self.details.get(track.audio_filepath)
+        if cached is not None and cached[0] == details:
+            self.details.move_to_end(track.audio_filepath)
+            return cached[1]
+        if not render:
+            return None
+
+        surface = pygame.Surface(self.details_size)
+        surface.blits([(font.render(text, True, color), position) for font, text, color, position in details], doreturn=False)
+        self.details[track.audio_filepath] = details, surface
+        if len(self.details) > self.max_details:
+            self.details.popitem(last=False)
+        return surface
+
+    def draw(self, screen, list_rect, center_y, details_position):
+        draw_time = perf_counter()
+        frame_time = min(.1, draw_time - self.last_draw_time)
+        self.last_draw_time = draw_time
+
+        num_tracks = self.library.count_tracks()
+        distance = self.selection_index - self.scroll_position
+        if abs(distance) < .01:
+            self.scroll_position = self.selection_index
+        else:
+            self.scroll_position += distance * min(1, frame_time * TrackList.SCROLL_RATE)
+
+        # Rows in sight
+        blits = []
+        half_rows = TrackList.NUM_ROWS // 2
+        first_index = max(0, int(self.scroll_position) - half_rows - 1)
+        last_index = min(num_tracks - 1, int(self.scroll_position) + half_rows + 2)
+        for i in range(first_index, last_index + 1):
+            offset = i - self.scroll_position
+            if abs(offset) > half_rows + 1:
+                continue
+            surface = self.get_row_surface(self.library.get_track(i))
+            blits.append((surface, (60 - 15 * min(half_rows, abs(offset)), center_y + offset * TrackList.ROW_SPACING - surface.get_height() / 2)))
+        previous_clip = screen.get_clip()
+        screen.set_clip(list_rect)
+        screen.blits(blits, doreturn=False)
+        screen.set_clip(previous_clip)
+
+        # Rows about to come into sight
+        num_prerendered = 0
+        start_index = self.selection_index + self.direction * (half_rows + 1)
+        for i in range(start_index, start_index + self.direction * TrackList.PRERENDER_ROWS, self.direction):
+            if not 0 <= i < num_tracks or num_prerendered == TrackList.MAX_PRERENDERS:
+                break
+            track = self.library.get_track(i)
+            if not self.is_row_rendered(track):
+                self.get_row_surface(track)
+                num_prerendered += 1
+
+        # Details of the selection, rendered once scrolling settles unless already cached
+        if 0 <= self.selection_index < num_tracks:
+            settled = abs(self.selection_index - self.scroll_position) < .5
+            surface = self.get_details_surface(self.library.get_track(self.selection_index), settled)
+            if surface:
+                screen.blit(surface, details_position)